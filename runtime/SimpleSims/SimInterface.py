@@ -27,12 +27,16 @@ sys.path.append(os.path.dirname(RUNTIME_DIR))
 
 import common.gui_utils as gutil # for sleep QT func
 from kinematics.dynamics import Dynamics
-from kinematics.kinematicsV2 import Kinematics
+from kinematics.kinematicsV2 import Kinematics, KinematicsResult, PoseCache
+from kinematics.actuator_limiter import ActuatorLimiter
+from kinematics.trajectory import TrajectoryExecutor
+from kinematics.lag_compensation import LagCompensator
 from kinematics.cfg_SlidingActuators import *
 from RemoteControls.RemoteControl import RemoteControl
 
 import output.d_to_p as d_to_p
 from output.muscle_output import MuscleOutput
+from output.valve_bias import ValveBiasCorrection
 
 import SimpleSims.available_sims  as sims  # sims to be loaded are defined in this module
 
@@ -76,6 +80,7 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         print("sim server:", self.simserver_addr)
 
         self.timer_data_update = None
+        self.trajectory = TrajectoryExecutor(DATA_PERIOD / 1000.0) # slow moves, advanced by data_update
         self.is_ready = False # True when platform config is loaded
         self.sn_avail = False  # space mouse
         self.sim = None
@@ -85,6 +90,8 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
 
         self.transform = (0,0,-1,0,0,0) # this will be updated when connected to sim
         self.target_pressures = [] # pressures sent to festo
+        self.muscle_output = None
+        self.valve_bias = None # corrects d_to_p output for valve bias from festo pressure readback if enabled in the config
 
         self.csv_outfile = None
         
@@ -106,6 +113,13 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
 
     def closeEvent(self, event):
         log.info("User exit")
+        if getattr(self, 'k', None) is not None and self.k.pose_cache is not None: # k is set when a config is loaded
+            log.info("pose cache hits %d, misses %d, hit ratio %.2f", *self.k.pose_cache.stats())
+        if self.valve_bias is not None:
+            self.valve_bias.stop()
+            log.info("valve bias correction updates %d, rejected %d", self.valve_bias.nbr_updates, self.valve_bias.nbr_rejected)
+        if self.muscle_output is not None:
+            log.info("festo frames sent %d, suppressed %d", *self.muscle_output.output_counters())
         if self.sim:
             self.sim = None
         event.accept()
@@ -167,6 +181,7 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
     def configure_kinematics(self):
         # load_config() must be called before this method 
         self.k = Kinematics()
+        self.ik_result = KinematicsResult() # buffers filled by self.k.solve each frame
         self.cfg.calculate_coords()
 
         self.k.set_geometry(self.cfg.BASE_POS, self.cfg.PLATFORM_POS)
@@ -178,6 +193,14 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
             # self.muscle_output.set_platform_params(self.cfg.MIN_ACTUATOR_LEN, self.cfg.MAX_ACTUATOR_LEN, self.cfg.FIXED_LEN)
             self.is_slider = False
             
+        self.k.set_workspace_limits(self.cfg.limits_6dof, self.cfg.limits_1dof)
+        if self.cfg.POSE_CACHE_ENTRIES:
+            self.k.set_pose_cache(PoseCache(self.cfg.POSE_CACHE_RESOLUTION, self.cfg.POSE_CACHE_ENTRIES))
+        self.limiter = ActuatorLimiter(self.cfg.ACTUATOR_MAX_VELOCITY, self.cfg.ACTUATOR_MAX_ACCEL, self.cfg.ACTUATOR_MAX_JERK, DATA_PERIOD / 1000.0)
+        self.limiter.reset(self.cfg.DISABLED_DISTANCES) # the platform starts parked
+        self.lag_compensator = None
+        if self.cfg.ACTUATOR_LAGS is not None:
+            self.lag_compensator = LagCompensator(self.cfg.ACTUATOR_LAGS, DATA_PERIOD / 1000.0)
         self.invert_axis = self.cfg.INVERT_AXIS 
         self.swap_roll_pitch = self.cfg.SWAP_ROLL_PITCH   
 
@@ -196,7 +219,7 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         self.actions = {'activate':  self.remote_activate, 'deactivate': self.remote_deactivate,
                    'pause': self.remote_pause, 'dispatch': self.remote_run, 'reset': self.reset_vr, 
                    'emergency_stop': self.remote_deactivate, 'intensity' : self.remote_intensity,
-                   'detected remote': self.detected_remote,  'payload' : self.action_ignore, 
+                   'detected remote': self.detected_remote,  'payload' : self.remote_payload, 
                    'show_parks' : self.action_ignore, 'scroll_parks' : self.action_ignore}       
         self.local_control = None
         if os.name == 'posix' and os.uname()[4].startswith("arm"):
@@ -247,6 +270,17 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         self.update_state('paused')      
     def remote_run(self):
        self.update_state('running')     
+    def remote_payload(self, payload):
+        # argument is string as "payload=n" where n is the payload in kg
+        if type(payload) == str and "payload=" in payload:
+            header, payload = payload.split('=', 2)
+        if self.muscle_output is None:
+            log.warning("payload ignored, platform config is not loaded")
+            return
+        try:
+            self.muscle_output.set_payload(int(payload))
+        except ValueError as e:
+            log.warning("unable to set payload: %s", e)
     def remote_intensity(self, intensity):
         if type(intensity) == str and "intensity=" in intensity:
             header, intensity = intensity.split('=', 2)
@@ -319,23 +353,33 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         legends = ('raw', 'washed')
    
     def do_washout(self, transform):       
-        washed = []
-        for t in transform:
-            washed.append(t* 1.1)
+        # returns transform with washout and tilt coordination applied (unchanged if the sim configured no washout)
+        washed = self.dynam.get_washed_telemetry(transform)
         data = [transform, washed]
         # self.plotter.plot(data)
+        return washed
         
     def data_update(self):
+        is_slow_moving = self.trajectory.is_active()
+        if is_slow_moving:
+            self.trajectory_step() # slow moves take priority over sim telemetry
         if not self.is_ready:
-            print("ignoring update because not ready")
-            return # don't output if distance to pressure file has not been loaded
+            # before a sim is connected the timer only runs for slow moves, stop it when they are done
+            if not self.trajectory.is_active():
+                self.timer_data_update.stop()
+                log.debug("data update timer stopped, no sim connected")
+            return
 
         elif self.sim:
             self.transform = self.sim.read()
             if not self.sim.is_connected:
                 self.report_state("Sim is not connected, is it running")
-            if self.transform:
-                self.move(self.transform)
+            if self.transform and not is_slow_moving:
+                if self.is_lookahead():
+                    # the frame the lag compensator needs is run through the pipeline, see lag_compensation.py
+                    self.move(self.sim.read_ahead(self.lag_compensator.lookahead))
+                else:
+                    self.move(self.transform)
             
             if self.RemoteControl:            
                 self.RemoteControl.service()
@@ -343,9 +387,13 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
                 self.local_control.service()    
 
                             
+    def is_lookahead(self):
+        # True if muscle lag is compensated using telemetry read ahead from the sim
+        return self.lag_compensator is not None and hasattr(self.sim, 'read_ahead')
+
     def move(self, transform):
         if self.is_output_enabled:
-            self.do_washout(transform)
+            transform = self.do_washout(transform)
             transform = [inv * axis for inv, axis in zip(self.invert_axis, transform)]          
             master_gain = self.ui.sld_gain_master.value() *.01     
             for idx in range(6): 
@@ -357,17 +405,22 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
             if self.swap_roll_pitch:
                 # swap roll, pitch and x,y if set in config
                 request[0],request[1], request[3],request[4] =  request[1],request[0],request[4], request[3] 
-            
-            percents = self.k.actuator_percents(request)
-            # print("request:", request, "percents:", percents)
+            # solve, scaling infeasible requests back onto the reachable workspace
+            request, scale = self.k.limit_request(request, self.ik_result)
+            if scale < 1.0:
+                log.debug("request scaled by %.3f to fit workspace", scale)
+            # print("request:", request, "percents:", self.ik_result.percents)
            
             #percents = remap_valves(percents)
-            distances = self.k.actuator_lengths(request)
+            distances = self.ik_result.lengths
+            if self.is_lookahead():
+                distances = self.lag_compensator.push(distances) # each muscle leads the visuals by its lag
+            distances = self.limiter.step(distances) # bound actuator velocity, accel and jerk
             if self.is_slider:
-                self.muscle_output.move_percent(percents)            
+                self.muscle_output.move_percent(self.k.percents_from_lens(distances))
             else:
                 self.muscle_output.move_distance(distances)
-            self.echo( request.tolist(), distances, self.k.get_pose())
+            self.echo( request.tolist(), distances, self.ik_result.pose)
 
     def sim_combo_changed(self):       
         idx = self.ui.cmb_sim_select.currentIndex()
@@ -449,7 +502,17 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
         self.park_platform(False)
         actuator_distances = self.k.actuator_lengths(self.transform)
         print("enabling")
-        self.slow_move(self.cfg.DISABLED_DISTANCES, actuator_distances, self.cfg.DISABLED_XFORM, self.transform, 100)
+        self.slow_move(self.cfg.DISABLED_DISTANCES, actuator_distances, self.cfg.DISABLED_XFORM, self.transform, 100, self.platform_enabled)
+
+    def platform_enabled(self, completed):
+        # called when the enabling move has finished, completed is False if it was pre-empted
+        # the trajectory has been driving the output so the limiter takes over from where it got to
+        self.limiter.reset(self.trajectory.position)
+        if not completed:
+            return
+        if self.lag_compensator is not None:
+            self.lag_compensator.reset(self.trajectory.position)
+        self.dynam.reset() # washout starts from rest so the first frame matches the transform just moved to
         # todo check sensor distance reading here to auto calibrate load ???
         if not self.is_output_enabled:
             self.is_output_enabled = True
@@ -462,44 +525,46 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
             self.is_output_enabled = False
             log.debug("Platform Disabled")
         # self.set_activation_buttons(False) fixme: needed when using physical buttons so gui is in sync
-        actuator_distances = self.k.actuator_lengths(self.transform)
-        self.slow_move(actuator_distances, self.cfg.DISABLED_DISTANCES, self.transform, self.cfg.DISABLED_XFORM,100)
-        self.park_platform(True)
+        # start from the last distances output by the limiter, the kinematics of the transform can be beyond them
+        actuator_distances = self.limiter.position.copy()
+        self.slow_move(actuator_distances, self.cfg.DISABLED_DISTANCES, self.transform, self.cfg.DISABLED_XFORM, 100, self.platform_disabled)
+
+    def platform_disabled(self, completed):
+        self.limiter.reset(self.trajectory.position) # as platform_enabled, the limiter holds the last output distances
+        self.dynam.reset()
+        if completed:
+            self.park_platform(True)
          
-    def slow_move(self, begin_dist, end_dist, begin_xform, end_xform, rate_mm_per_sec):
-        # moves from the given begin to end distances at the given duration
-        #  caution, this moves even if disabled
-        interval = .05  # ms between steps
-        distance = max([abs(j-i) for i,j in zip(begin_dist, end_dist)])
-        dur = abs(distance) / rate_mm_per_sec
-        steps = int(dur / interval)
-        xform_steps = [(j-i)/steps for i,j in zip(begin_xform, end_xform)]
-        if steps < 1:
-            self.muscle_output.move_distance(end_dist)
-        else:
-            current_dist = begin_dist
-            current_xform = begin_xform
-            print("moving from", begin_dist, "to", end_dist, "steps", steps)
-            # print("xform from", begin_xform, "to", end_xform)
-            # print "percent", (end[0]/start[0]) * 100
-            delta = [float(e - s)/steps for s, e in zip(begin_dist, end_dist)]
-            for step in range(steps):
-                current_dist = [x + y for x, y in zip(current_dist, delta)]
-                current_dist = np.clip(current_dist, 0, 6000)
-                self.muscle_output.move_distance(current_dist)
-                current_xform = [ i+j for i, j in zip(current_xform, xform_steps)]
-                self.echo(current_xform, current_dist, self.k.get_pose())
-                # print("echoing", [round(x,1) for x in current_xform],  current_dist)
-                gutil.sleep_qt(interval)
-                
+    def slow_move(self, begin_dist, end_dist, begin_xform, end_xform, rate_mm_per_sec, on_complete=None):
+        # starts an S-curve move from the given begin to end distances, peak actuator speed is the given rate
+        # returns immediately, the move is advanced by data_update and on_complete is called with True when done
+        #  or False if pre-empted by another move.  caution, this moves even if disabled
+        if self.trajectory.is_active():
+            # start from where the pre-empted move has got to (its begin position if it has not yet stepped)
+            begin_dist, begin_xform = self.trajectory.position, self.trajectory.xform
+        self.start_trajectory([self.trajectory.move(begin_dist, end_dist, begin_xform, end_xform, rate_mm_per_sec)], on_complete,
+                              (begin_dist, begin_xform))
+
+    def start_trajectory(self, segments, on_complete, begin=None):
+        self.trajectory.start(segments, on_complete, begin)
+        if not self.timer_data_update.isActive():
+            self.timer_data_update.start(DATA_PERIOD) # slow moves run before a sim is connected, see data_update
+
+    def trajectory_step(self):
+        distances, xform = self.trajectory.step()
+        self.muscle_output.move_distance(distances)
+        self.echo(xform, distances, self.k.get_pose())
+
     def swell_for_access(self):
         if self.cfg.HAS_PISTON and not self.is_output_enabled:
             #Briefly raises platform high enough to insert access stairs and activate piston
             log.debug("Start swelling for access")
-            self.slow_move(self.cfg.DISABLED_DISTANCES, self.cfg.PROPPING_DISTANCES,  self.cfg.DISABLED_XFORM, self.cfg.PROPPING_XFORM, 100)
-            gutil.sleep_qt(3) # time in seconds in up pos
-            self.slow_move(self.cfg.PROPPING_DISTANCES, self.cfg.DISABLED_DISTANCES,  self.cfg.PROPPING_XFORM, self.cfg.DISABLED_XFORM, 100)
-            log.debug("Finished swelling for access")
+            t = self.trajectory
+            self.start_trajectory([t.move(self.cfg.DISABLED_DISTANCES, self.cfg.PROPPING_DISTANCES, self.cfg.DISABLED_XFORM, self.cfg.PROPPING_XFORM, 100),
+                                   t.hold(self.cfg.PROPPING_DISTANCES, self.cfg.PROPPING_XFORM, 3), # time in seconds in up pos
+                                   t.move(self.cfg.PROPPING_DISTANCES, self.cfg.DISABLED_DISTANCES, self.cfg.PROPPING_XFORM, self.cfg.DISABLED_XFORM, 100)],
+                                  lambda completed: log.debug("Finished swelling for access" if completed else "Swelling for access pre-empted"),
+                                  (self.cfg.DISABLED_DISTANCES, self.cfg.DISABLED_XFORM))
    
         
     def park_platform(self, do_park):
@@ -603,10 +668,13 @@ class MainWindow(QtWidgets.QMainWindow, Ui_MainWindow):
             # self.cfg.calculate_coords() # this is called in configure_kinematics
             self.DtoP = d_to_p.D_to_P(200) # argument is max distance 
             self.muscle_output = MuscleOutput(self.DtoP.distance_to_pressure, self.festo_ip)
+            self.muscle_output.set_send_policy(self.cfg.OUTPUT_DEADBAND, self.cfg.OUTPUT_KEEPALIVE)
             self.configure_kinematics()
             # load distance to pressure curves from file
-            if self.DtoP.load(self.cfg.DISTANCE_TO_PRESSURE_TABLE): 
-                print("todo: add option for polynomial instead of lookup?")
+            self.DtoP.load(self.cfg.DISTANCE_TO_PRESSURE_TABLE, self.cfg.DISTANCE_TO_PRESSURE_MODEL)
+            if self.cfg.VALVE_BIAS_CORRECTION:
+                self.valve_bias = ValveBiasCorrection(self.DtoP, self.muscle_output.festo)
+                self.valve_bias.start()
             self.ui.grp_sim.setEnabled(True) 
             self.ui.lbl_sim_status.setText("Click 'Load Sim' if not already running\nClick 'Connect' when sim is loaded") 
             self.init_remote_controls()    
@@ -22,8 +22,8 @@ log = logging.getLogger(__name__)
 
 
 # Helper class to decode rotation quaternion into pitch/yaw/roll
-from numpy import sin, cos, arctan2, sqrt, pi  # import from numpy
-import numpy as np
+# math functions are used as the numpy equivalents are slow on scalars
+from math import atan2
 
 
 class Quaternion (object):
@@ -40,16 +40,32 @@ class Quaternion (object):
         vx = 2 * (self.x * self.y + self.w * self.y)
         vy = 2 * (self.w * self.x - self.y * self.z)
         vz = 1.0 - 2 * (self.x * self.x + self.y * self.y)
-        return arctan2(vy, sqrt(vx * vx + vz * vz))
+        return atan2(vy, sqrt(vx * vx + vz * vz))
 
     def toYawFromYUp(self):
-        return arctan2(2 * (self.x * self.y + self.w * self.y),
-                       1.0 - 2 * (self.x * self.x + self.y * self.y))
+        return atan2(2 * (self.x * self.y + self.w * self.y),
+                     1.0 - 2 * (self.x * self.x + self.y * self.y))
 
     def toRollFromYUp(self):
-        return arctan2(2 * (self.x * self.y + self.w * self.z),
-                       1.0 - 2 * (self.x * self.x + self.z * self.z))
-                       
+        return atan2(2 * (self.x * self.y + self.w * self.z),
+                     1.0 - 2 * (self.x * self.x + self.z * self.z))
+
+    def to_euler(self):
+        # returns roll, pitch, yaw in one call, same values as the three methods above
+        x, y, z, w = self.x, self.y, self.z, self.w
+        xy = x * y
+        xx = x * x
+        vx = 2 * (xy + w * y)
+        vz = 1.0 - 2 * (xx + y * y)
+        roll = atan2(2 * (xy + w * z), 1.0 - 2 * (xx + z * z))
+        pitch = atan2(2 * (w * x - y * z), sqrt(vx * vx + vz * vz))
+        return roll, pitch, atan2(vx, vz)
+
+    def to_platform(self):
+        # returns x, y, z, w with the axes moved from the coaster frame (x side, y up, z forward)
+        #  to the platform frame (x forward, y side, z up), see kinematicsV2.quaternion_to_rotation
+        return self.z, self.x, self.y, self.w
+
 class CoasterInterface():
 
     N_MSG_OK = 1
@@ -84,6 +100,7 @@ class CoasterInterface():
         self.telemetry_data = None
         self._telemetry_state_flags = 0
         self.prev_yaw = None
+        self.quat = None # real world orientation (only set when real world values are used, see _process_telemetry_msg)
         self.prev_time = time.time()
         self.lift_height = 32  # max height in meters
         self.is_paused = False
@@ -267,17 +284,18 @@ class CoasterInterface():
             if(False): # set this to True to use real world values (not supported in this version)
                 #  code here is non-normalized (real) translation and rotation messages
                 quat = Quaternion(msg.quatX, msg.quatY, msg.quatZ, msg.quatW)
-                pitch = degrees(quat.toPitchFromYUp())
-                yaw = degrees(quat.toYawFromYUp())
-                roll = degrees(quat.toRollFromYUp())
+                self.quat = quat
+                roll, pitch, yaw = [degrees(angle) for angle in quat.to_euler()]
                 #print format("telemetry %.2f, %.2f, %.2f" % (roll, pitch, yaw))
             else:  # normalize
                 #print "quat", msg.quatX, msg.quatY, msg.quatZ, msg.quatW,
-                quat = Quaternion(msg.quatX, msg.quatY, msg.quatZ, msg.quatW) 
-                self.quat = quat
-                roll = quat.toRollFromYUp() / pi
-                pitch = -quat.toPitchFromYUp() * 0.6 # reduce intensity of pitch
-                yaw = -quat.toYawFromYUp()
+                # the normalized values are scaled per axis and yaw becomes a rate before washout,
+                #  so euler angles are used here and the quaternion path of Kinematics.solve is not
+                quat = Quaternion(msg.quatX, msg.quatY, msg.quatZ, msg.quatW)
+                roll, pitch, yaw = quat.to_euler()
+                roll = roll / pi
+                pitch = -pitch * 0.6 # reduce intensity of pitch
+                yaw = -yaw
                 y.append(yaw)
                 
                 self.flip=0
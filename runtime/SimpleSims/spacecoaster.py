@@ -131,8 +131,10 @@ class Sim(object):
             print(e)
             return(str(e)) 
 
-    def connect(self):
+    def connect(self, server_addr=None):
         # returns string code or None if no error
+        # server_addr is accepted for the common sim interface (SimInterface.connect_sim) but not used,
+        #  telemetry is received on PORT from any address
         if self.thread_handle  == None:
             try:
                 self.thread_handle = threading.Thread(target=self.listener_thread, args= (self.HOST, self.PORT))
@@ -166,6 +168,13 @@ class Sim(object):
         return self.levels
 
 
+    def read_ahead(self, nbr_frames):
+        # returns the telemetry frame the given number of frames after the most recently read frame
+        #  the ride telemetry is known in advance so future frames can be used to compensate for muscle lag
+        if self.state != State.running or not self.telemetry:
+            return self.levels
+        return self.telemetry[min(self.frame_number - 1 + nbr_frames, len(self.telemetry) - 1)]
+
     def get_washout_config(self):
         return [0,0,0,0,0,0]
         
@@ -0,0 +1,76 @@
+""" actuator_limiter
+Velocity, acceleration and jerk limiting of actuator distances between the kinematics and the muscle output
+
+Each frame the limiter moves every actuator toward its requested distance as fast as the limits allow,
+ the state of all six actuators is held in arrays and advanced together so the cost per frame is fixed.
+The velocity is also capped so each actuator can decelerate to its target (allowing for the jerk ramp) without
+ overshoot, so spikes in the sim telemetry are smoothed rather than sent straight to the valves.
+Velocity and acceleration are hard limits, the jerk limit shapes the acceleration ramps but can be exceeded
+ on the frame a move ends or reaches the velocity limit.
+
+    limiter = ActuatorLimiter(cfg.ACTUATOR_MAX_VELOCITY, cfg.ACTUATOR_MAX_ACCEL, cfg.ACTUATOR_MAX_JERK, .05)
+    limiter.reset(current_distances)
+    distances = limiter.step(requested_distances)  # call once per frame
+"""
+
+import numpy as np
+
+import logging
+log = logging.getLogger(__name__)
+
+class ActuatorLimiter(object):
+    def __init__(self, max_velocity, max_accel, max_jerk, frame_period=0.05):
+        # limits are in mm/s, mm/s^2 and mm/s^3, a single value or one per actuator, zero disables that limit
+        self.frame_period = frame_period # seconds between calls to step
+        self.max_velocity = self.as_limit(max_velocity)
+        self.max_accel = self.as_limit(max_accel)
+        self.max_jerk = self.as_limit(max_jerk)
+        self.position = np.zeros(6)
+        self.velocity = np.zeros(6)
+        self.accel = np.zeros(6)
+        self.nbr_limited = 0 # frames where at least one actuator did not reach its request
+
+    def as_limit(self, value):
+        limit = np.array(np.broadcast_to(np.asarray(value, dtype=float), (6,)))
+        limit[limit <= 0] = np.inf
+        return limit
+
+    def reset(self, distances):
+        # sets the actuators at rest at the given distances, call when the platform is enabled
+        self.position[:] = distances
+        self.velocity[:] = 0
+        self.accel[:] = 0
+
+    def step(self, distances):
+        # returns the limited distances for one frame toward the requested distances
+        dt = self.frame_period
+        error = np.asarray(distances, dtype=float) - self.position
+        # velocity and distance moved while the current accel is ramped to zero at the jerk limit
+        ramp_time = np.abs(self.accel) / self.max_jerk
+        ramp_velocity = self.velocity + self.accel * ramp_time / 2
+        remaining = error - (self.velocity * ramp_time + self.accel * ramp_time * ramp_time / 3)
+        # fastest velocity that can still stop at the target with the accel limit (discrete time form)
+        with np.errstate(invalid='ignore'): # inf limits give nan, replaced by inf below
+            braking = self.max_accel * dt
+            distance = np.maximum(np.abs(remaining) - np.abs(ramp_velocity) * self.max_accel / self.max_jerk / 2, 0)
+            stopping = braking * (np.sqrt(2 * distance / (braking * dt) + 0.25) - 0.5)
+        stopping[np.isnan(stopping)] = np.inf
+        velocity = np.clip(remaining / dt, -stopping, stopping)
+        np.clip(velocity, -self.max_velocity, self.max_velocity, out=velocity)
+        accel = np.clip((velocity - self.velocity) / dt, -self.max_accel, self.max_accel)
+        jerk = np.clip((accel - self.accel) / dt, -self.max_jerk, self.max_jerk)
+        prev_velocity = self.velocity.copy()
+        self.accel += jerk * dt
+        self.velocity += self.accel * dt
+        np.clip(self.velocity, -self.max_velocity, self.max_velocity, out=self.velocity)
+        step = self.velocity * dt
+        # finish a move exactly on the target when the accel limit allows, rather than overshooting
+        arrive = (np.abs(step) > np.abs(error)) & (np.abs(error / dt - prev_velocity) <= braking * 1.0001)
+        if arrive.any():
+            step[arrive] = error[arrive]
+            self.velocity[arrive] = error[arrive] / dt
+            self.accel[arrive] = 0
+        self.position += step
+        if not np.allclose(self.position, distances, atol=0.5):
+            self.nbr_limited += 1
+        return self.position.copy()
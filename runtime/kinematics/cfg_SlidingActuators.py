@@ -30,6 +30,8 @@ class PlatformConfig(object):
     PLATFORM_TYPE = "SLIDER"
     PLATFORM_INVERTED = False
     DISTANCE_TO_PRESSURE_TABLE = 'output/DtoP.csv'
+    DISTANCE_TO_PRESSURE_MODEL = 'table' # 'table' for table lookup, 'spline' for curves fitted to the table
+    VALVE_BIAS_CORRECTION = False # set True to correct valve bias from festo pressure readback (see output/valve_bias.py)
 
     def __init__(self):
     
@@ -74,6 +76,24 @@ class PlatformConfig(object):
         # limits at extremes of movement
         self.limits_6dof = [40, 40, 50, math.radians(6), math.radians(6), math.radians(6)]
 
+        # requests repeated to within this resolution (mm and radians) reuse cached kinematics (see PoseCache)
+        # set entries to a non zero size, eg 4096, to enable the cache for rides that repeat the same poses
+        self.POSE_CACHE_RESOLUTION = (.5, .5, .5, math.radians(.05), math.radians(.05), math.radians(.05))
+        self.POSE_CACHE_ENTRIES = 0
+
+        # actuator motion limits applied to each frame before output (see actuator_limiter.py), zero disables a limit
+        self.ACTUATOR_MAX_VELOCITY = 400 # mm per second
+        self.ACTUATOR_MAX_ACCEL = 2000 # mm per second squared
+        self.ACTUATOR_MAX_JERK = 20000 # mm per second cubed
+
+        # festo frames are only sent if a pressure changes by more than the deadband (millibars) or at the keepalive interval
+        self.OUTPUT_DEADBAND = 10
+        self.OUTPUT_KEEPALIVE = 0.5 # seconds
+
+        # seconds each muscle lags its commanded pressure, estimated with kinematics/lag_compensation.py
+        # used on rides that can read telemetry ahead (sims with read_ahead), None disables lookahead
+        self.ACTUATOR_LAGS = None
+
         self.MIN_ACTUATOR_LEN = 0  
         self.MAX_ACTUATOR_RANGE = self.slider_range
         self.MAX_ACTUATOR_LEN = self.slider_range        
@@ -42,6 +42,8 @@ class PlatformConfig(object):
     PLATFORM_TYPE = "Inverted Stewart Platform"
     PLATFORM_INVERTED = True
     DISTANCE_TO_PRESSURE_TABLE = 'output/chair_DtoP.csv'
+    DISTANCE_TO_PRESSURE_MODEL = 'table' # 'table' for table lookup, 'spline' for curves fitted to the table
+    VALVE_BIAS_CORRECTION = False # set True to correct valve bias from festo pressure readback (see output/valve_bias.py)
 
     def __init__(self):
         self.PLATFORM_UNLOADED_WEIGHT = 25  # weight of moving platform without 'passenger' in killograms
@@ -71,6 +73,24 @@ class PlatformConfig(object):
         # limits at extremes of movement
         self.limits_6dof = (80, 80, 80, math.radians(12), math.radians(12), math.radians(10))
 
+        # requests repeated to within this resolution (mm and radians) reuse cached kinematics (see PoseCache)
+        # set entries to a non zero size, eg 4096, to enable the cache for rides that repeat the same poses
+        self.POSE_CACHE_RESOLUTION = (.5, .5, .5, math.radians(.05), math.radians(.05), math.radians(.05))
+        self.POSE_CACHE_ENTRIES = 0
+
+        # actuator motion limits applied to each frame before output (see actuator_limiter.py), zero disables a limit
+        self.ACTUATOR_MAX_VELOCITY = 500 # mm per second
+        self.ACTUATOR_MAX_ACCEL = 3000 # mm per second squared
+        self.ACTUATOR_MAX_JERK = 30000 # mm per second cubed
+
+        # festo frames are only sent if a pressure changes by more than the deadband (millibars) or at the keepalive interval
+        self.OUTPUT_DEADBAND = 10
+        self.OUTPUT_KEEPALIVE = 0.5 # seconds
+
+        # seconds each muscle lags its commanded pressure, estimated with kinematics/lag_compensation.py
+        # used on rides that can read telemetry ahead (sims with read_ahead), None disables lookahead
+        self.ACTUATOR_LAGS = None
+
         self.DISABLED_DISTANCES = [self.MAX_ACTUATOR_LEN *.05] * 6
         self.PROPPING_DISTANCES = [self.MAX_ACTUATOR_LEN *.08] * 6 # length for attaching stairs or moving prop
         self.DISABLED_XFORM = [0, 0, -self.limit_Z, 0, 0, 0] # only used to echo slow moves
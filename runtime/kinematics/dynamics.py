@@ -1,4 +1,6 @@
 # dynamics (was shape)
+# scales normalized sim telemetry to real world requests, applying washout (Washout) and the per DOF
+#  response curves configured in shape.cfg, eg: curve,surge,power,0.5
 
 import traceback
 import numpy as np
@@ -14,10 +16,149 @@ class frame_gui(QtWidgets.QFrame, ui):
 import logging
 log = logging.getLogger(__name__)
 
+class Washout(object):
+    # classical washout filter advancing all six DOF with one matrix-vector product per frame
+    #  each DOF has a second order high pass filter so sustained requests return to centre,
+    #  sustained surge and sway are low pass filtered and added to pitch and roll (tilt coordination)
+    #  so the rider feels a sustained acceleration as a tilt once the translation has washed out
+    # the continuous filters are combined into one state space system and discretized with the bilinear (Tustin) method
+    # inputs and outputs are normalized xyzrpy values (-1 to 1)
+    NBR_STATES = 16 # two states for each of the six high pass filters and the two tilt low pass filters
+    DEFAULT_TILT_CUTOFF = 2.0 # radians per second
+
+    def __init__(self, frame_period=0.05):
+        self.frame_period = frame_period  # seconds between frames
+        self.washout_time = np.zeros(6) # seconds to decay below 2%, zero disables washout of that DOF
+        self.tilt_gain = np.zeros(2) # normalized pitch per unit of surge and roll per unit of sway, zero disables tilt
+        self.tilt_cutoff = self.DEFAULT_TILT_CUTOFF
+        # critically damped, the fastest return to centre without oscillating. Like any second order high pass
+        #  a sustained step still undershoots once, by e**-2 (13.5%) at 2/w seconds (w = 5.8 / washout_time)
+        self.damping = 1.0
+        self.system = None
+        self.buffer = np.zeros(self.NBR_STATES + 6) # filter state followed by the current input
+        self.result = np.zeros(self.NBR_STATES + 6) # next state followed by the output
+        self.build()
+
+    def set_washout_time(self, idx, seconds):
+        self.washout_time[idx] = seconds
+        self.build()
+
+    def set_tilt(self, surge_to_pitch, sway_to_roll, cutoff=None):
+        # gains are normalized pitch (or roll) per unit of sustained surge (or sway), sign sets the tilt direction
+        self.tilt_gain[:] = surge_to_pitch, sway_to_roll
+        if cutoff:
+            self.tilt_cutoff = cutoff
+        self.build()
+
+    def continuous_system(self):
+        # returns the A, B, C, D matrices of the combined continuous filters
+        n = self.NBR_STATES
+        A = np.zeros((n, n))
+        B = np.zeros((n, 6))
+        C = np.zeros((6, n))
+        D = np.eye(6)
+        for idx in range(6):
+            if self.washout_time[idx] <= 0:
+                continue # washout disabled, output follows input
+            # s^2 / (s^2 + 2*z*w*s + w^2), (1 - w*t) * exp(-w*t) of a step is below 2% when w*t is 5.8
+            w = 5.8 / self.washout_time[idx]
+            i = idx * 2
+            A[i, i+1] = 1
+            A[i+1, i:i+2] = -w * w, -2 * self.damping * w
+            B[i+1, idx] = 1
+            C[idx, i:i+2] = -w * w, -2 * self.damping * w
+        w = self.tilt_cutoff
+        for tilt, (source, target) in enumerate(((0, 4), (1, 3))): # surge to pitch, sway to roll
+            if self.tilt_gain[tilt] == 0:
+                continue
+            # w^2 / (s^2 + 2*z*w*s + w^2)
+            i = 12 + tilt * 2
+            A[i, i+1] = 1
+            A[i+1, i:i+2] = -w * w, -2 * self.damping * w
+            B[i+1, source] = 1
+            C[target, i] = self.tilt_gain[tilt] * w * w
+        return A, B, C, D
+
+    def build(self):
+        # discretizes the filters into one augmented matrix mapping [state, input] to [next state, output]
+        A, B, C, D = self.continuous_system()
+        n = self.NBR_STATES
+        T = self.frame_period
+        inverse = np.linalg.inv(np.eye(n) - A * T / 2)
+        Bd = inverse @ B * T
+        system = np.zeros((n + 6, n + 6))
+        system[:n, :n] = inverse @ (np.eye(n) + A * T / 2)
+        system[:n, n:] = Bd
+        system[n:, :n] = C @ inverse
+        system[n:, n:] = D + C @ Bd / 2
+        self.system = system
+
+    def reset(self):
+        # returns the filters to rest, the next output starts from the raw input
+        self.buffer[:] = 0
+
+    def step(self, request):
+        # returns washed values for one frame of normalized xyzrpy
+        self.buffer[self.NBR_STATES:] = request
+        np.dot(self.system, self.buffer, out=self.result)
+        self.buffer[:self.NBR_STATES] = self.result[:self.NBR_STATES]
+        return self.result[self.NBR_STATES:].copy()
+
+    def process(self, requests, block=16):
+        # returns (N, 6) washed values for an (N, 6) array of consecutive frames, eg a recorded ride
+        # starts from rest and leaves the filter state unchanged
+        # the filter is recursive so frames are processed in blocks: within a block the state after frame i is
+        #   Ad**(i+1) @ start + sum over j <= i of Ad**(i-j) @ Bd @ input[j]
+        #   the input terms of all blocks are one matrix product, only the block start states are sequential
+        n = self.NBR_STATES
+        Ad, Bd = self.system[:n, :n], self.system[:n, n:]
+        requests = np.asarray(requests, dtype=float).reshape(-1, 6)
+        nbr_blocks = -(-len(requests) // block)
+        inputs = np.zeros((nbr_blocks * block, 6))
+        inputs[:len(requests)] = requests
+        powers = np.empty((block + 1, n, n)) # Ad**k
+        powers[0] = np.eye(n)
+        for k in range(block):
+            powers[k + 1] = Ad @ powers[k]
+        lags = np.subtract.outer(np.arange(block), np.arange(block))
+        kernel = powers[np.maximum(lags, 0)] @ Bd # (block, block, n, 6) response at frame i to input j
+        kernel[lags < 0] = 0
+        kernel = kernel.transpose(0, 2, 1, 3).reshape(block * n, block * 6)
+        # states after each frame of every block if the block started from rest
+        after = (inputs.reshape(nbr_blocks, block * 6) @ kernel.T).reshape(nbr_blocks, block, n)
+        starts = powers[1:].reshape(block * n, n) # maps the block start state to the state after each frame
+        state = np.zeros(n)
+        for idx in range(nbr_blocks):
+            after[idx] += (starts @ state).reshape(block, n)
+            state = after[idx, -1]
+        states = np.concatenate((np.zeros((1, n)), after.reshape(-1, n)[:len(requests) - 1])) # state before each frame
+        return states @ self.system[n:, :n].T + requests @ self.system[n:, n:].T
+
+CURVE_POINTS = 201 # samples of each response curve table spanning normalized inputs -1 to 1
+DOF_NAMES = ('surge', 'sway', 'heave', 'roll', 'pitch', 'yaw')
+
+def compile_curve(spec):
+    # returns CURVE_POINTS outputs of the response curve given by a shape.cfg curve spec (list of strings):
+    #   linear                  output equals input
+    #   power,e                 sign(x) * |x|**e, eg power,0.5 is the square root compression used by some sims
+    #   points,x0,y0,x1,y1,...  piecewise linear through the given points for inputs 0 to 1
+    # curves are odd functions so negative inputs mirror the positive half
+    x = np.linspace(-1, 1, CURVE_POINTS)
+    kind = spec[0].strip()
+    if kind == 'linear':
+        return x
+    elif kind == 'power':
+        return np.sign(x) * np.abs(x) ** float(spec[1])
+    elif kind == 'points':
+        values = [float(v) for v in spec[1:]]
+        return np.sign(x) * np.interp(np.abs(x), values[0::2], values[1::2])
+    raise ValueError(format("unknown response curve type '%s'" % kind))
+
 class Dynamics(object):
     def __init__(self, frame_rate=0.05):
         self.frame_rate = frame_rate
         self.prev_washout_value = [0,0,0,0,0,0]
+        self.washout = Washout(frame_rate)
         self.use_gui = False
 
     def init_gui(self, frame):
@@ -49,6 +190,26 @@ class Dynamics(object):
         #  washout_time is number of seconds to decay below 2%
         self.washout_time = [12, 12, 12, 12, 0, 12]        
         self.washout_factor = np.array([0.0, 0.0, 0.0, 0.0, 0.0, 0.0])     
+        self.default_response()
+
+    def default_response(self):
+        # linear response curves and no tilt coordination, read_config starts from these so a reloaded
+        #  file without curve or tilt lines does not keep the values of an earlier load
+        self.set_tilt(0, 0, Washout.DEFAULT_TILT_CUTOFF)
+        # response curves of all six DOF are held end to end in one table so a single np.interp applies them,
+        #  the input for DOF i is offset by 3*i so the segments (each spanning -1 to 1) never overlap
+        self.curve_offsets = np.arange(6) * 3.0
+        self.curve_x = (np.linspace(-1, 1, CURVE_POINTS) + self.curve_offsets[:, np.newaxis]).ravel()
+        self.curve_y = np.tile(np.linspace(-1, 1, CURVE_POINTS), 6)
+        self.curve_specs = [None] * 6 # shape.cfg spec of each DOF, None is linear
+        self.use_curves = False
+
+    def set_curve(self, idx, spec):
+        # sets the response curve of the given DOF from a list of strings (see compile_curve)
+        curve = compile_curve(spec)
+        self.curve_y[idx * CURVE_POINTS:(idx + 1) * CURVE_POINTS] = curve
+        self.curve_specs[idx] = [field.strip() for field in spec]
+        self.use_curves = True
 
     def move_slider_changed(self, sender_id):
         value = self.intensity_sliders[sender_id].value()
@@ -94,19 +255,30 @@ class Dynamics(object):
         else:
             self.washout_factor[idx] = 1.0 - self.frame_rate / value * 4
             #  print "in shape", idx, " washout time set to ", value, "decay factor=", self.washout_factor[idx]
+        self.washout.set_washout_time(idx, value)
+
+    def set_tilt(self, surge_to_pitch, sway_to_roll, cutoff=None):
+        # tilt coordination gains, see Washout.set_tilt
+        self.washout.set_tilt(surge_to_pitch, sway_to_roll, cutoff)
+
+    def reset(self):
+        # clears the washout filter state, call when the platform is enabled or disabled so stale state
+        #  from an earlier ride does not offset the first frames of the next
+        self.washout.reset()
+        self.prev_washout_value = [0,0,0,0,0,0]
 
     def get_washouts(self): # returns the configured washout time 
         #  print "in shape", self.washout_time
         return self.washout_time
     
     def get_washed_telemetry(self, telemetry): # returns washed telemetry
-        for idx, f in enumerate(self.washout_factor):
-            #  if washout enabled and request is less than prev washed value, decay more
-            if f != 0 and abs(telemetry[idx]) < abs(self.prev_washout_value[idx]):
-                #  here if washout is enabled
-                telemetry[idx] =  self.prev_washout_value[idx] * self.washout_factor[idx]
-        self.prev_washout_value = telemetry  
-        return telemetry        
+        # advances the washout filters one frame, this is the callback passed to sims by set_washout_callback
+        self.prev_washout_value = self.washout.step(telemetry)
+        return self.prev_washout_value
+
+    def wash_ride(self, telemetry):
+        # returns washed values for an (N, 6) array of recorded telemetry frames in one call
+        return self.washout.process(telemetry)
 
     
     def regulate(self, request):
@@ -116,34 +288,40 @@ class Dynamics(object):
         r = np.multiply(request, self.gains) * self.master_gain
         np.clip(r, -1, 1, r)  # clip normalized values
         #  print "clipped", r
-        """ 
-        for idx, f in enumerate(self.washout_factor):
-            #  if washout enabled and request is less than prev washed value, decay more
-            if f != 0 and abs(request[idx]) < abs(self.prev_washout_value[idx]):
-                #  here if washout is enabled
-                r[idx] =  self.prev_washout_value[idx] * self.washout_factor[idx]
-        self.prev_washout_value = r       
-        """ 
+        if self.use_curves:
+            r = np.interp(r + self.curve_offsets, self.curve_x, self.curve_y)
+        #  washout is applied to the telemetry before regulate, see get_washed_telemetry
         #  convert from normalized to real world values
         r = np.multiply(r, self.range)  
         #print "real",r, self.range
         return r
 
     def read_config(self):
-        # in this version we only read gains
+        # reads gains, tilt and response curves, tilt and curves not in the file revert to their defaults
         try:
             with open(self.config_fname) as f:
                 lines = f.readlines()
+                self.default_response()
                 for line in lines:
                     fields = line.split(',')
                     if fields[0] == 'gains':
                        gains = fields[1:]
                        self.gains = np.array([float(i) for i in fields[1:-1]])
                        self.master_gain = float(fields[7])
+                    elif fields[0] == 'tilt':
+                       # tilt,surge_to_pitch,sway_to_roll,cutoff in radians per second
+                       self.set_tilt(float(fields[1]), float(fields[2]), float(fields[3]))
+                    elif fields[0] == 'curve':
+                       # curve,dof,type,parameters where dof is a name (surge...yaw) or index, see compile_curve
+                       dof = fields[1].strip()
+                       idx = DOF_NAMES.index(dof) if dof in DOF_NAMES else int(dof)
+                       self.set_curve(idx, fields[2:])
             log.info("loaded gains from file %s", self.config_fname)
             self.update_sliders()
         except IOError:
             log.warning("Using defaults gains (unable to open gains config file %s)", self.config_fname)
+        except ValueError as e:
+            log.error("error in config file %s: %s", self.config_fname, e)
 
     def save_config(self):
         try:
@@ -152,6 +330,11 @@ class Dynamics(object):
                 #generate an array with strings
                 arrstr = np.char.mod('%.2f', self.gains)
                 gain_str = ','.join(arrstr) + ',' + str(self.master_gain)
-                outfile.write("gains," + gain_str)
+                outfile.write("gains," + gain_str + "\n")
+                tilt = self.washout
+                outfile.write(format("tilt,%.3f,%.3f,%.2f\n" % (tilt.tilt_gain[0], tilt.tilt_gain[1], tilt.tilt_cutoff)))
+                for idx, spec in enumerate(self.curve_specs):
+                    if spec is not None:
+                        outfile.write("curve," + DOF_NAMES[idx] + "," + ",".join(spec) + "\n")
         except Exception as e: 
             log.error("error saving gains to %s: %s", self.config_fname, e)
\ No newline at end of file
@@ -3,6 +3,13 @@ This module provides inverse kinematics for the Mdx motion platforms
   The core method, named inverse_kinematics is passed the desired orientation as: [surge, sway, heave, roll, pitch yaw]
   and returns the platform pose as an array of coordinates for the attachment points 
   Pose is converted to actuator lengths using the method: actuator_len_from_pose
+  actuator_batch solves an (N, 6) array of requests in one vectorized call, returning poses, lengths and percents
+  forward_kinematics returns the xyzrpy giving six measured actuator lengths (forward_kinematics_batch for many)
+  jacobian and conditioning return the analytic actuator jacobian, its condition number and actuator velocity gains
+  solve accepts an optional quaternion (see quaternion_to_rotation) that sets the rotation without euler angles,
+    for real world orientation feeds, the normalized sim pipelines (NL2, washout) use euler angles
+  KinematicsStack solves several configured Kinematics instances (chairs and sliders) in one vectorized call
+  set_pose_cache enables a PoseCache so requests repeated to within its resolution skip the kinematics
   NOTE: all length values returned represent muscle contraction amounts (not length of muscle)
  
 
@@ -12,14 +19,122 @@ import sys
 import math
 import traceback
 import copy
+from collections import OrderedDict
 import numpy as np
 
 import logging
 log = logging.getLogger(__name__)
 
+def solve_sliders(poses, slider_origin, slider_dirs, struts_squared, joint_min_offset, joint_max_offset):
+    # closed form solution for the slider positions of the given poses
+    # poses is an array of upper ball joint coordinates with shape (..., 6, 3)
+    # each carriage is at slider_origin + offset * slider_dir, the offset where the sphere of strut length
+    # around the upper joint cuts the slider line is the larger root of: offset**2 + 2*b*offset + c = 0
+    #   where w = slider_origin - pose, b = w.slider_dir, c = w.w - strut_length**2
+    # returns offsets clamped to the joint offset range, carriage coordinates and an out of reach flag per actuator
+    # note: a precomputed workspace lookup table (multilinear interpolation of b and c on a 9 point per DOF grid
+    #   over limits_1dof) was evaluated in place of this: 80 us per solve against 54 us, up to 3.2 mm error
+    #   within limits_6dof and a 25 MB table, so the closed form is used
+    w = slider_origin - poses
+    b = np.einsum('...ij,...ij->...i', w, slider_dirs) # slider_dirs is (6, 3) or stacked per platform
+    c = np.einsum('...ij,...ij->...i', w, w) - struts_squared
+    discriminant = b*b - c
+    # a negative discriminant means the strut can't reach the slider line, use the closest point
+    offset = np.sqrt(np.maximum(discriminant, 0)) - b
+    out_of_reach = (discriminant < 0) | (offset < joint_min_offset) | (offset > joint_max_offset)
+    np.clip(offset, joint_min_offset, joint_max_offset, out=offset)
+    coords = slider_origin + offset[..., np.newaxis] * slider_dirs
+    return offset, coords, out_of_reach
+
+def quaternion_to_rotation(quaternion, out=None):
+    # returns the rotation matrix of a unit quaternion given as x, y, z, w, no trig functions are needed
+    # the quaternion axes must be in the platform frame (x forward, y side, z up)
+    x, y, z, w = quaternion
+    R = np.empty((3, 3)) if out is None else out
+    xx = x*x; yy = y*y; zz = z*z
+    xy = x*y; xz = x*z; yz = y*z
+    wx = w*x; wy = w*y; wz = w*z
+    R[0,0] = 1 - 2*(yy + zz)
+    R[0,1] = 2*(xy - wz)
+    R[0,2] = 2*(xz + wy)
+    R[1,0] = 2*(xy + wz)
+    R[1,1] = 1 - 2*(xx + zz)
+    R[1,2] = 2*(yz - wx)
+    R[2,0] = 2*(xz - wy)
+    R[2,1] = 2*(yz + wx)
+    R[2,2] = 1 - 2*(xx + yy)
+    return R
+
+def scale_quaternion(quaternion, scale):
+    # returns the quaternion with its rotation angle multiplied by scale (used to apply intensity)
+    if scale == 1.0:
+        return quaternion
+    x, y, z, w = quaternion
+    sin_half = math.sqrt(x*x + y*y + z*z)
+    if sin_half < 1e-12:
+        return quaternion
+    half_angle = math.atan2(sin_half, w) * scale
+    ratio = math.sin(half_angle) / sin_half
+    return x * ratio, y * ratio, z * ratio, math.cos(half_angle)
+
+class KinematicsResult(object):
+    # caller owned buffers filled in place by Kinematics.solve, allocate once and reuse every frame
+    def __init__(self):
+        self.pose = np.zeros((6, 3)) # platform attachment points
+        self.lengths = np.zeros(6) # actuator contraction distances in mm
+        self.percents = np.zeros(6)
+        self.slider_coords = np.zeros((6, 3)) # carriage coordinates (slider platform only)
+        self.out_of_reach = np.zeros(6, dtype=bool) # True where an actuator was clamped to the end of its range
+        # scratch buffers
+        self.rotation = np.zeros((3, 3))
+        self.xyz = np.zeros(3)
+        self.xlate = np.zeros((6, 3))
+        self.vectors = np.zeros((6, 3))
+        self.b = np.zeros(6)
+        self.c = np.zeros(6)
+        self.flags = np.zeros(6, dtype=bool)
+
+class PoseCache(object):
+    # bounded LRU cache of solved requests, keyed on the request quantized to the given resolution
+    # resolution is a sequence of six values in mm and radians, eg (.5,.5,.5, math.radians(.05), ...)
+    # requests within the same quantization step return the values solved for the first of them
+    def __init__(self, resolution, max_entries=4096):
+        self.resolution = np.asarray(resolution, dtype=float)
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, request):
+        return np.rint(np.divide(request, self.resolution)).astype(np.int64).tobytes()
+
+    def get(self, key):
+        # returns the entry for the given key or None, a hit makes the entry the most recently used
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False) # evict least recently used
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        # returns hits, misses and hit ratio since the counters were created
+        total = self.hits + self.misses
+        return self.hits, self.misses, self.hits / total if total else 0.0
+
 class Kinematics(object):
     def __init__(self):
         np.set_printoptions(precision=3,suppress=True)
+        self.pose_cache = None # see set_pose_cache
 
     def clamp(self, n, minn, maxn):
         return max(min(maxn, n), minn)
@@ -28,6 +143,7 @@ class Kinematics(object):
         self.base_coords = base_coords
         self.platform_coords = platform_coords       
         self.intensity = 1.0
+        self.clear_pose_cache()
 
     def set_slider_params(self, joint_min_offset, joint_max_offset, strut_length, slider_angles, slider_endpoints ):
         # parameters for the slider platform
@@ -40,10 +156,27 @@ class Kinematics(object):
         self.is_slider = True
         self.slider_origin = copy.deepcopy(self.platform_coords)
         self.slider_origin[:,2] = 0 # set z to zero
-        self.temp_max_iter =0
+        # unit vector along each slider in the direction of increasing offset from the ball joint
+        angles = np.array([a[0] for a in slider_angles], dtype=float)
+        self.slider_dirs = np.zeros((6, 3))
+        self.slider_dirs[:,0] = np.array([a[1] for a in slider_angles]) * np.sin(angles)
+        self.slider_dirs[:,1] = np.array([a[2] for a in slider_angles]) * np.cos(angles)
+        self.slider_out_of_reach = np.zeros(6, dtype=bool)
         self.actuator_range = joint_max_offset - joint_min_offset
+        self.clear_pose_cache()
         log.info("Kinematics set for sliding platform")
 
+    def set_pose_cache(self, pose_cache):
+        # when set, solve and actuator_lengths return cached values for requests repeated within the cache resolution
+        # pass None to disable caching
+        self.pose_cache = pose_cache
+        self.cache_result = KinematicsResult() # buffers for actuator_lengths when caching
+
+    def clear_pose_cache(self):
+        # cached values are invalid once the geometry, slider params or intensity change
+        if self.pose_cache is not None:
+            self.pose_cache.clear()
+
     def set_platform_params(self, min_actuator_len, max_actuator_len, fixed_len):
         #  paramaters for a conventional (normal or inverted) stewart platform
         self.min_actuator_len = min_actuator_len
@@ -51,6 +184,7 @@ class Kinematics(object):
         self.fixed_len = fixed_len
         self.actuator_range = max_actuator_len - min_actuator_len
         self.is_slider = False  # will be set True iff set_slider_params method is called
+        self.clear_pose_cache()
         log.info("Kinematics set for chairs")
 
     def calc_rotation(self, rpy):
@@ -71,6 +205,50 @@ class Kinematics(object):
                          [-sin_pitch, cos_pitch*sin_roll, cos_pitch*cos_roll]])
         return Rxyz
 
+    def calc_rotations(self, rpy):
+        # return array of N rotation matrices from an (N, 3) array of roll,pitch,yaw
+        rpy = np.asarray(rpy, dtype=float)
+        cos_roll, cos_pitch, cos_yaw = np.cos(rpy).T
+        sin_roll, sin_pitch, sin_yaw = np.sin(rpy).T
+        Rxyz = np.empty((rpy.shape[0], 3, 3))
+        Rxyz[:, 0, 0] = cos_yaw*cos_pitch
+        Rxyz[:, 0, 1] = cos_yaw*sin_pitch*sin_roll - sin_yaw*cos_roll
+        Rxyz[:, 0, 2] = cos_yaw*sin_pitch*cos_roll + sin_yaw*sin_roll
+        Rxyz[:, 1, 0] = sin_yaw*cos_pitch
+        Rxyz[:, 1, 1] = sin_yaw*sin_pitch*sin_roll + cos_yaw*cos_roll
+        Rxyz[:, 1, 2] = sin_yaw*sin_pitch*cos_roll - cos_yaw*sin_roll
+        Rxyz[:, 2, 0] = -sin_pitch
+        Rxyz[:, 2, 1] = cos_pitch*sin_roll
+        Rxyz[:, 2, 2] = cos_pitch*cos_roll
+        return Rxyz
+
+    def inverse_kinematics_batch(self, requests):
+        # requests: (N, 6) array of x,y,z translations in mm, roll, pitch, yaw rotations in radians
+        # returns (N, 6, 3) array of platform attachment points, one pose per request
+        xyzrpy = np.asarray(requests, dtype=float).reshape(-1, 6) * self.intensity
+        platform_xlate = xyzrpy[:, np.newaxis, 0:3] + self.platform_coords # surge, sway, heave
+        Rxyz = self.calc_rotations(xyzrpy[:, 3:6])
+        return np.einsum('nij,nkj->nki', Rxyz, platform_xlate)
+
+    def actuator_batch(self, requests):
+        # returns (N, 6, 3) poses and (N, 6) arrays of actuator lengths and percents for (N, 6) requests
+        # values match actuator_lengths and actuator_percents for each row of requests
+        poses = self.inverse_kinematics_batch(requests)
+        lengths = self.len_from_poses(poses)
+        return poses, lengths, self.percents_from_lens(lengths)
+
+    def len_from_poses(self, poses):
+        # returns (N, 6) array of distances actuators must move from min position for (N, 6, 3) poses
+        if self.is_slider:
+            dist, coords = self.slider_pos_from_poses(poses)
+            return dist
+        else:
+            muscle_len = np.linalg.norm(poses - self.base_coords, axis=2)
+            return np.clip(np.rint(muscle_len - self.min_actuator_len), 0, self.actuator_range)
+
+    def percents_from_lens(self, lengths):
+        return np.round((np.asarray(lengths) * 100.0) / self.actuator_range, 1)
+
     def inverse_kinematics(self, request):
         # request: x,y,z translations in mm, roll, pitch, yaw rotations in radians
         # returns numpy 3d array of platform attachment points
@@ -88,7 +266,93 @@ class Kinematics(object):
             self.pose[i, :] = np.dot(Rxyz, platform_xlate[i, :])
         return self.pose  # 6 rows of 3d platform attachment points
 
+    def solve(self, request, result, quaternion=None):
+        # single pass inverse kinematics filling the buffers of the given KinematicsResult
+        # request: x,y,z translations in mm, roll, pitch, yaw rotations in radians
+        # gives the same values as actuator_lengths and actuator_percents without allocating new arrays
+        # if a quaternion (x,y,z,w in the platform frame) is given it sets the rotation and request[3:6] is ignored
+        use_cache = self.pose_cache is not None and quaternion is None # the cache is keyed on rpy requests
+        if use_cache:
+            key = self.pose_cache.key(request)
+            entry = self.pose_cache.get(key)
+            if entry is not None:
+                result.pose[:], result.lengths[:], result.percents[:], result.slider_coords[:], result.out_of_reach[:] = entry
+                self.pose = result.pose
+                if self.is_slider:
+                    self.slider_out_of_reach = result.out_of_reach
+                return result
+        intensity = self.intensity
+        R = result.rotation
+        if quaternion is not None:
+            quaternion_to_rotation(scale_quaternion(quaternion, intensity), R)
+        else:
+            roll = request[3] * intensity
+            pitch = request[4] * intensity
+            yaw = request[5] * intensity
+            cos_roll = math.cos(roll)
+            sin_roll = math.sin(roll)
+            cos_pitch = math.cos(pitch)
+            sin_pitch = math.sin(pitch)
+            cos_yaw = math.cos(yaw)
+            sin_yaw = math.sin(yaw)
+            R[0,0] = cos_yaw*cos_pitch
+            R[0,1] = cos_yaw*sin_pitch*sin_roll - sin_yaw*cos_roll
+            R[0,2] = cos_yaw*sin_pitch*cos_roll + sin_yaw*sin_roll
+            R[1,0] = sin_yaw*cos_pitch
+            R[1,1] = sin_yaw*sin_pitch*sin_roll + cos_yaw*cos_roll
+            R[1,2] = sin_yaw*sin_pitch*cos_roll - cos_yaw*sin_roll
+            R[2,0] = -sin_pitch
+            R[2,1] = cos_pitch*sin_roll
+            R[2,2] = cos_pitch*cos_roll
+        xyz = result.xyz
+        xyz[0] = request[0] * intensity
+        xyz[1] = request[1] * intensity
+        xyz[2] = request[2] * intensity
+        np.add(self.platform_coords, xyz, out=result.xlate)
+        np.matmul(result.xlate, R.T, out=result.pose)
+        self.pose = result.pose
+
+        lengths = result.lengths
+        if self.is_slider:
+            # in place form of solve_sliders
+            w = np.subtract(self.slider_origin, result.pose, out=result.vectors)
+            b = np.einsum('ij,ij->i', w, self.slider_dirs, out=result.b)
+            c = np.einsum('ij,ij->i', w, w, out=result.c)
+            c -= self.struts_squared
+            np.multiply(b, b, out=lengths)
+            lengths -= c # discriminant
+            np.less(lengths, 0, out=result.out_of_reach)
+            np.maximum(lengths, 0, out=lengths)
+            np.sqrt(lengths, out=lengths)
+            lengths -= b
+            np.logical_or(result.out_of_reach, np.less(lengths, self.joint_min_offset, out=result.flags), out=result.out_of_reach)
+            np.logical_or(result.out_of_reach, np.greater(lengths, self.joint_max_offset, out=result.flags), out=result.out_of_reach)
+            np.clip(lengths, self.joint_min_offset, self.joint_max_offset, out=lengths)
+            np.multiply(lengths[:, np.newaxis], self.slider_dirs, out=result.slider_coords)
+            result.slider_coords += self.slider_origin
+            lengths -= self.joint_min_offset
+            self.slider_out_of_reach = result.out_of_reach
+        else:
+            v = np.subtract(result.pose, self.base_coords, out=result.vectors)
+            np.multiply(v, v, out=v)
+            np.sum(v, axis=1, out=lengths)
+            np.sqrt(lengths, out=lengths)
+            lengths -= self.min_actuator_len
+            np.less(lengths, 0, out=result.out_of_reach)
+            np.logical_or(result.out_of_reach, np.greater(lengths, self.actuator_range, out=result.flags), out=result.out_of_reach)
+            np.rint(lengths, out=lengths)
+            np.clip(lengths, 0, self.actuator_range, out=lengths)
+        np.multiply(lengths, 100.0, out=result.percents)
+        result.percents /= self.actuator_range
+        np.round(result.percents, 1, out=result.percents)
+        if use_cache:
+            self.pose_cache.put(key, (result.pose.copy(), lengths.copy(), result.percents.copy(),
+                                      result.slider_coords.copy(), result.out_of_reach.copy()))
+        return result
+
     def actuator_lengths(self, xyzrpy):
+        if self.pose_cache is not None:
+            return self.solve(xyzrpy, self.cache_result).lengths.copy()
         pose = self.inverse_kinematics(xyzrpy)
         return self.len_from_pose(pose)
     
@@ -152,43 +416,18 @@ class Kinematics(object):
     def slider_pos_from_pose(self, pose):
         # calculate where the sliders need to be for the given pose
         # returns array of slider offsets and array of slider coordinates
-        dist = []
-        coords = []
-        for idx in range(6): 
-            d = (self.joint_max_offset+self.joint_min_offset)/2 # start at slider mid point
-            delta = 64 # (self.joint_max_offset-self.joint_min_offset) / 4
-            for iter in range(9):
-                point = self.point_at_distance(idx, d)
-                # d1 is distance from upper ball joint to slider at pos d
-                d1 = np.rint(np.linalg.norm(point-pose[idx]))
-                if self.strut_length-d1 == 0:
-                    break
-                else:
-                    if self.strut_length-d1 < 0:
-                        # here if d1 larger than strut length 
-                        if  d < self.joint_min_offset:
-                            d = self.joint_min_offset
-                            break
-                        else:
-                            d -= delta
-                    else:
-                        # here if d1 less than strut length
-                        if  d > self.joint_max_offset:
-                            d = self.joint_max_offset
-                            break
-                        else:
-                            d += delta
-                    if delta >=2: # smallest step is 1mm
-                        delta /= 2 
-                if iter > 6:
-                    print(format("iter= %d, d=%d, err= %d, delta=%d" %(iter, d, self.strut_length-d1, delta)))
-            if iter > self.temp_max_iter:
-                self.temp_max_iter = iter
-            dist.append(d-self.joint_min_offset)
-            coords.append(point)
-        print("in kinematics, distances:", dist)
-        return dist, coords
-        
+        # self.slider_out_of_reach is set True for actuators clamped to the ends of their slider
+        dist, coords, self.slider_out_of_reach = solve_sliders(pose, self.slider_origin, self.slider_dirs,
+                         self.struts_squared, self.joint_min_offset, self.joint_max_offset)
+        return dist - self.joint_min_offset, coords
+
+    def slider_pos_from_poses(self, poses):
+        # vectorized form of slider_pos_from_pose for an (N, 6, 3) array of poses
+        # returns (N, 6) array of slider offsets and (N, 6, 3) array of slider coordinates
+        dist, coords, self.slider_out_of_reach = solve_sliders(poses, self.slider_origin, self.slider_dirs,
+                         self.struts_squared, self.joint_min_offset, self.joint_max_offset)
+        return dist - self.joint_min_offset, coords
+
     """
     def slider_percents(self, xyzrpy):
         # convenience method returns array of slider percents for given orientation
@@ -196,11 +435,304 @@ class Kinematics(object):
         return self.slider_percent_from_pose(pose)
     """
     
+    def raw_lengths(self, xyzrpy):
+        # returns (N, 6) unclamped and unrounded actuator distances for an (N, 6) array of platform positions
+        # unlike the request methods, the intensity is not applied to xyzrpy
+        xyzrpy = np.asarray(xyzrpy, dtype=float).reshape(-1, 6)
+        platform_xlate = xyzrpy[:, np.newaxis, 0:3] + self.platform_coords
+        poses = np.einsum('nij,nkj->nki', self.calc_rotations(xyzrpy[:, 3:6]), platform_xlate)
+        if self.is_slider:
+            offsets, coords, out_of_reach = solve_sliders(poses, self.slider_origin, self.slider_dirs, self.struts_squared, -np.inf, np.inf)
+            return offsets - self.joint_min_offset
+        else:
+            return np.linalg.norm(poses - self.base_coords, axis=2) - self.min_actuator_len
+
+    def rotation_partials(self, rpy):
+        # returns (N, 3, 3) rotation matrices and (N, 3, 3, 3) derivatives with respect to roll, pitch and yaw
+        # the rotation matrix is the same as calc_rotation, the derivatives are taken element by element
+        rpy = np.asarray(rpy, dtype=float)
+        cos_roll, cos_pitch, cos_yaw = np.cos(rpy).T
+        sin_roll, sin_pitch, sin_yaw = np.sin(rpy).T
+        R = self.calc_rotations(rpy)
+        partials = np.zeros((rpy.shape[0], 3, 3, 3))
+        d_roll = partials[:, 0]
+        d_roll[:, 0, 1] = cos_yaw*sin_pitch*cos_roll + sin_yaw*sin_roll
+        d_roll[:, 0, 2] = -cos_yaw*sin_pitch*sin_roll + sin_yaw*cos_roll
+        d_roll[:, 1, 1] = sin_yaw*sin_pitch*cos_roll - cos_yaw*sin_roll
+        d_roll[:, 1, 2] = -sin_yaw*sin_pitch*sin_roll - cos_yaw*cos_roll
+        d_roll[:, 2, 1] = cos_pitch*cos_roll
+        d_roll[:, 2, 2] = -cos_pitch*sin_roll
+        d_pitch = partials[:, 1]
+        d_pitch[:, 0, 0] = -cos_yaw*sin_pitch
+        d_pitch[:, 0, 1] = cos_yaw*cos_pitch*sin_roll
+        d_pitch[:, 0, 2] = cos_yaw*cos_pitch*cos_roll
+        d_pitch[:, 1, 0] = -sin_yaw*sin_pitch
+        d_pitch[:, 1, 1] = sin_yaw*cos_pitch*sin_roll
+        d_pitch[:, 1, 2] = sin_yaw*cos_pitch*cos_roll
+        d_pitch[:, 2, 0] = -cos_pitch
+        d_pitch[:, 2, 1] = -sin_pitch*sin_roll
+        d_pitch[:, 2, 2] = -sin_pitch*cos_roll
+        # yaw only rotates the first two rows into each other
+        partials[:, 2, 0] = -R[:, 1]
+        partials[:, 2, 1] = R[:, 0]
+        return R, partials
+
+    def jacobian_batch(self, xyzrpy):
+        # returns (N, 6) raw lengths and (N, 6, 6) analytic jacobians d(length)/d(xyzrpy) for an (N, 6) array of positions
+        # rows are actuators, columns are surge, sway, heave (mm) and roll, pitch, yaw (radians)
+        # the intensity is not applied to xyzrpy (see jacobian for requests)
+        xyzrpy = np.asarray(xyzrpy, dtype=float).reshape(-1, 6)
+        R, partials = self.rotation_partials(xyzrpy[:, 3:6])
+        platform_xlate = xyzrpy[:, np.newaxis, 0:3] + self.platform_coords
+        poses = np.einsum('nij,nkj->nki', R, platform_xlate)
+        # d(pose)/d(xyzrpy) for each attachment point, shape (N, 6 points, 3 coords, 6 dof)
+        dpose = np.empty(poses.shape + (6,))
+        dpose[..., 0:3] = R[:, np.newaxis, :, :]
+        dpose[..., 3:6] = np.einsum('nmij,nkj->nkim', partials, platform_xlate)
+        if self.is_slider:
+            offsets, coords, out_of_reach = solve_sliders(poses, self.slider_origin, self.slider_dirs, self.struts_squared, -np.inf, np.inf)
+            # strut vectors satisfy |strut| = strut_length, so d(offset) = strut.d(pose) / strut.slider_dir
+            struts = coords - poses
+            with np.errstate(divide='ignore', invalid='ignore'): # the gain is infinite where a strut is normal to its slider
+                direction = struts / np.einsum('nkj,kj->nk', struts, self.slider_dirs)[..., np.newaxis]
+            # where the strut can't reach its slider the offset is the closest point, which moves with the pose
+            direction[out_of_reach] = np.broadcast_to(self.slider_dirs, out_of_reach.shape + (3,))[out_of_reach]
+            return offsets - self.joint_min_offset, np.einsum('nkj,nkjm->nkm', direction, dpose)
+        else:
+            vectors = poses - self.base_coords
+            lengths = np.linalg.norm(vectors, axis=2)
+            units = vectors / lengths[..., np.newaxis]
+            return lengths - self.min_actuator_len, np.einsum('nkj,nkjm->nkm', units, dpose)
+
+    def fk_jacobian(self, xyzrpy):
+        # returns (N, 6) raw lengths and (N, 6, 6) jacobians of raw lengths with respect to xyzrpy
+        return self.jacobian_batch(xyzrpy)
+
+    def jacobian(self, request):
+        # returns the 6x6 jacobian of actuator distances with respect to the request (intensity applied)
+        lengths, J = self.jacobian_batch(np.asarray(request, dtype=float) * self.intensity)
+        return J[0] * self.intensity
+
+    def conditioning(self, request):
+        # returns jacobian, condition number and largest velocity gain of each actuator at the given request
+        # when limits_1dof are set (set_workspace_limits) the jacobian columns are scaled by them, so the
+        #   condition number compares DOF by their full range and each gain is the actuator movement in mm per unit
+        #   of normalized request, ie a normalized request rate of 1 per second can move actuator i by gain[i] mm/s
+        J = self.jacobian(request)
+        limits = getattr(self, 'limits_1dof', None)
+        scaled = J if limits is None else J * limits
+        return J, np.linalg.cond(scaled), np.linalg.norm(scaled, axis=1)
+
+    def forward_kinematics_batch(self, lengths, initial=None, max_iter=20, tolerance=0.01, damping=1e-3):
+        # damped Newton-Raphson solve for the platform xyzrpy giving each row of an (N, 6) array of actuator lengths
+        # lengths are contraction distances as returned by raw_lengths (the intensity is not applied)
+        # initial is an optional (N, 6) array of starting positions, zero (mid position) if not given
+        # returns (N, 6) xyzrpy array, (N,) bool array set True where the residual is below tolerance mm
+        # and the number of iterations used
+        lengths = np.asarray(lengths, dtype=float).reshape(-1, 6)
+        if initial is None:
+            xyzrpy = np.zeros(lengths.shape)
+        else:
+            xyzrpy = np.array(initial, dtype=float).reshape(-1, 6)
+        converged = np.zeros(len(lengths), dtype=bool)
+        for iteration in range(max_iter + 1):
+            active = ~converged
+            estimate, jacobian = self.fk_jacobian(xyzrpy[active])
+            residual = estimate - lengths[active]
+            done = np.abs(residual).max(axis=1) < tolerance
+            converged[np.flatnonzero(active)[done]] = True
+            if converged.all() or iteration == max_iter:
+                break
+            jacobian = jacobian[~done]
+            residual = residual[~done]
+            # Levenberg-Marquardt style damping scaled by the diagonal copes with mixed mm and radian units
+            jtj = np.einsum('nki,nkj->nij', jacobian, jacobian)
+            jtj += damping * jtj * np.eye(6)
+            step = np.linalg.solve(jtj, np.einsum('nki,nk->ni', jacobian, residual)[..., np.newaxis])[..., 0]
+            xyzrpy[np.flatnonzero(~converged)] -= step
+        return xyzrpy, converged, iteration
+
+    def forward_kinematics(self, lengths, max_iter=20, tolerance=0.01):
+        # returns the platform xyzrpy for the six given actuator lengths (see forward_kinematics_batch)
+        # warm started from the previous result so frame to frame tracking usually needs one or two iterations
+        # returns None if the solver did not converge, the next call then starts from the mid position
+        if getattr(self, 'fk_estimate', None) is None:
+            self.fk_estimate = np.zeros(6)
+        xyzrpy, converged, self.fk_iterations = self.forward_kinematics_batch(lengths, self.fk_estimate, max_iter, tolerance)
+        if converged[0]:
+            self.fk_estimate = xyzrpy[0]
+            return self.fk_estimate.copy() # caller may modify the result, the estimate must not change
+        self.fk_estimate = None
+        return None
+
+    def set_workspace_limits(self, limits_6dof, limits_1dof=None):
+        # limits_6dof: the range in mm or radians of each DOF that is reachable in any combination (see platform config)
+        # limits_1dof: the range of each DOF on its own, used to normalize the jacobian in conditioning
+        self.limits_6dof = np.asarray(limits_6dof, dtype=float)
+        if limits_1dof is not None:
+            self.limits_1dof = np.asarray(limits_1dof, dtype=float)
+
+    def is_reachable(self, requests):
+        # returns (N,) bool array, True where every actuator of the request is within its range
+        poses = self.inverse_kinematics_batch(requests)
+        if self.is_slider:
+            offsets, coords, out_of_reach = solve_sliders(poses, self.slider_origin, self.slider_dirs,
+                         self.struts_squared, self.joint_min_offset, self.joint_max_offset)
+            return ~out_of_reach.any(axis=1)
+        else:
+            lengths = np.linalg.norm(poses - self.base_coords, axis=2) - self.min_actuator_len
+            return ((lengths >= 0) & (lengths <= self.actuator_range)).all(axis=1)
+
+    def limit_request(self, request, result, rounds=3, steps=16):
+        # solves the request into the given KinematicsResult, scaled back toward the mid position if it is not reachable
+        # returns the request solved and the scale used (1.0 if reachable)
+        # the direction of the request is kept, unlike clamping each actuator separately
+        # reachable requests are solved once, feasibility comes from the out_of_reach flags of solve
+        # otherwise the scale is found by bisection evaluating all the scales of a round in one batch,
+        #   limits_6dof (set_workspace_limits) gives the starting lower bound, it is checked in case the limits are optimistic
+        request = np.asarray(request, dtype=float)
+        if not self.solve(request, result).out_of_reach.any():
+            return request, 1.0
+        magnitude = np.abs(request * self.intensity)
+        lo = 0.0
+        hi = 1.0
+        limits = getattr(self, 'limits_6dof', None)
+        if limits is not None and magnitude.any():
+            lo = min(1.0, np.min(limits[magnitude > 0] / magnitude[magnitude > 0]))
+        first = lo
+        for _ in range(rounds):
+            scales = np.linspace(first, hi, steps + 1)[:-1] # hi is known to be unreachable
+            reachable = self.is_reachable(scales[:, np.newaxis] * request)
+            if reachable.all():
+                lo = scales[-1]
+            else:
+                first_unreachable = np.argmin(reachable)
+                hi = scales[first_unreachable]
+                lo = scales[first_unreachable - 1] if first_unreachable > 0 else 0.0
+            first = lo
+        request = request * lo
+        self.solve(request, result)
+        return request, lo
+
     def set_intensity(self, intensity):
         self.intensity = intensity
+        self.clear_pose_cache()
         print("Kinematics intensity set to", self.intensity)
         log.info("Kinematics intensity set to %.1f", intensity)
 
+class KinematicsStack(object):
+    # solves several platforms in one vectorized call per frame
+    # each platform is a Kinematics instance set up as usual (set_geometry, set_slider_params or set_platform_params,
+    #   set_intensity), chairs and sliders can be mixed
+    # requests are not clipped, as with Kinematics out of range actuators are clamped (see slider_out_of_reach)
+    # call refresh after changing the geometry or intensity of any platform
+    # benchmark_stack compares it with separate solve calls, run from this directory as: python kinematicsV2.py bench stack
+    def __init__(self, platforms):
+        self.platforms = list(platforms)
+        self.refresh()
+
+    def refresh(self):
+        platforms = self.platforms
+        self.platform_coords = np.array([k.platform_coords for k in platforms], dtype=float)
+        self.base_coords = np.array([k.base_coords for k in platforms], dtype=float)
+        self.intensity = np.array([k.intensity for k in platforms], dtype=float)[:, np.newaxis]
+        self.actuator_range = np.array([k.actuator_range for k in platforms], dtype=float)[:, np.newaxis]
+        self.is_slider = np.array([k.is_slider for k in platforms])
+        sliders = [k for k in platforms if k.is_slider]
+        if sliders:
+            self.slider_origin = np.array([k.slider_origin for k in sliders])
+            self.slider_dirs = np.array([k.slider_dirs for k in sliders])
+            self.struts_squared = np.array([k.struts_squared for k in sliders])
+            self.joint_min_offset = np.array([k.joint_min_offset for k in sliders], dtype=float)[:, np.newaxis]
+            self.joint_max_offset = np.array([k.joint_max_offset for k in sliders], dtype=float)[:, np.newaxis]
+        chairs = [k for k in platforms if not k.is_slider]
+        if chairs:
+            self.min_actuator_len = np.array([k.min_actuator_len for k in chairs], dtype=float)[:, np.newaxis]
+        self.slider_out_of_reach = np.zeros((len(sliders), 6), dtype=bool)
+
+    def solve(self, requests):
+        # requests: (P, 6) array with a row of x,y,z (mm), roll, pitch, yaw (radians) for each platform
+        # returns (P, 6, 3) poses, (P, 6) actuator lengths and (P, 6) percents, rows in platform order
+        requests = np.asarray(requests, dtype=float) * self.intensity
+        rotations = self.platforms[0].calc_rotations(requests[:, 3:6])
+        platform_xlate = requests[:, np.newaxis, 0:3] + self.platform_coords
+        poses = np.einsum('nij,nkj->nki', rotations, platform_xlate)
+        lengths = np.empty(requests.shape)
+        if self.is_slider.any():
+            offsets, coords, self.slider_out_of_reach = solve_sliders(poses[self.is_slider], self.slider_origin, self.slider_dirs,
+                                                        self.struts_squared, self.joint_min_offset, self.joint_max_offset)
+            lengths[self.is_slider] = offsets - self.joint_min_offset
+        if not self.is_slider.all():
+            chairs = ~self.is_slider
+            muscle_len = np.linalg.norm(poses[chairs] - self.base_coords[chairs], axis=2)
+            lengths[chairs] = np.clip(np.rint(muscle_len - self.min_actuator_len), 0, self.actuator_range[chairs])
+        percents = np.round((lengths * 100.0) / self.actuator_range, 1)
+        return poses, lengths, percents
+
+def benchmark(k, nbr_calls=2000):
+    # compares per call time and peak memory of the two pass and the single pass (solve) kinematics
+    import time
+    import tracemalloc
+    requests = np.random.uniform(-.5, .5, (nbr_calls, 6)) * [40, 40, 50, .1, .1, .1]
+    result = KinematicsResult()
+
+    def two_pass(request):
+        k.actuator_percents(request)
+        k.actuator_lengths(request)
+
+    def single_pass(request):
+        k.solve(request, result)
+
+    def cached(request):
+        k.solve(request, result)
+
+    for name, func in (("actuator_percents + actuator_lengths", two_pass), ("solve", single_pass), ("solve with pose cache", cached)):
+        if func is cached:
+            # second lap of the same requests is served from the cache
+            k.set_pose_cache(PoseCache((.5, .5, .5, math.radians(.05), math.radians(.05), math.radians(.05)), nbr_calls))
+            for request in requests:
+                func(request)
+        start = time.perf_counter()
+        for request in requests:
+            func(request)
+        per_call = (time.perf_counter() - start) / nbr_calls
+        tracemalloc.start()
+        peak = 0
+        for request in requests[:100]:
+            tracemalloc.reset_peak()
+            base = tracemalloc.get_traced_memory()[0]
+            func(request)
+            peak = max(peak, tracemalloc.get_traced_memory()[1] - base)
+        tracemalloc.stop()
+        print(format("%-40s %7.1f us per call, %6d bytes peak allocation per call" % (name, per_call * 1e6, peak)))
+    print("pose cache hits, misses, hit ratio:", k.pose_cache.stats())
+    k.set_pose_cache(None)
+
+def benchmark_stack(platforms, nbr_frames=2000):
+    # compares per frame time of solving each platform with Kinematics.solve against one KinematicsStack.solve
+    #  and checks that both give the same actuator lengths
+    import time
+    stack = KinematicsStack(platforms)
+    requests = np.random.uniform(-.5, .5, (nbr_frames, len(platforms), 6)) * [40, 40, 50, .1, .1, .1]
+    results = [KinematicsResult() for k in platforms]
+    lengths = np.empty((len(platforms), 6))
+    max_err = 0
+    for frame in requests[:100]:
+        for i, k in enumerate(platforms):
+            lengths[i] = k.solve(frame[i], results[i]).lengths
+        max_err = max(max_err, np.abs(stack.solve(frame)[1] - lengths).max())
+    start = time.perf_counter()
+    for frame in requests:
+        for i, k in enumerate(platforms):
+            k.solve(frame[i], results[i])
+    separate = (time.perf_counter() - start) / nbr_frames
+    start = time.perf_counter()
+    for frame in requests:
+        stack.solve(frame)
+    stacked = (time.perf_counter() - start) / nbr_frames
+    print(format("%d platforms: %.1f us per frame with separate solve calls, %.1f us with KinematicsStack, max difference %.3f mm"
+                 % (len(platforms), separate * 1e6, stacked * 1e6, max_err)))
+
 def test(request):
     distances =  k.actuator_lengths(request)
     print(request,   "distances:", distances,  "percents:", k.percent_from_len(distances))
@@ -274,10 +806,24 @@ if __name__ == "__main__":
 
     # test_suite()    
 
+    if len(sys.argv) > 1 and sys.argv[1] == "bench":
+        if len(sys.argv) > 2 and sys.argv[2] == "stack":
+            # a mix of sliders and chairs as used for a multi platform installation
+            import cfg_SuspendedChair
+            chair_cfg = cfg_SuspendedChair.PlatformConfig()
+            chair_cfg.calculate_coords()
+            chair = Kinematics()
+            chair.set_geometry(chair_cfg.BASE_POS, chair_cfg.PLATFORM_POS)
+            chair.set_platform_params(chair_cfg.MIN_ACTUATOR_LEN, chair_cfg.MAX_ACTUATOR_LEN, chair_cfg.FIXED_LEN)
+            benchmark_stack([k, chair, k, chair, k] if is_slider else [chair, k, chair, k, chair])
+        else:
+            benchmark(k)
+        exit()
+
     #  user input
     print("translation values in mm, rotation in degrees") 
     
-    plot3D = plot_config.Plot3dCarriages(cfg, k.slider_endpoints)
+    renderer = plot_config.PoseRenderer(cfg, k.slider_endpoints if is_slider else None)
     
     while True:
         inp = input("enter orientation on command line as: surge, sway, heave, roll, pitch yaw ")
@@ -320,10 +866,13 @@ if __name__ == "__main__":
                 pos =  dist # temp np.array([-100 + dist, 0,0 ])
                 # plot_config.plot_actuator(slider_endpoints, top_point, pos)     
                 print( 'slider_endpoints', slider_endpoints,'top_point',top_point, 'pos',   pos)               
-                plot_config.plot3d(cfg, k.pose)
+                dist, coords = k.slider_pos_from_pose(pose)
+                renderer.update(pose, coords, k.percent_from_len(dist))
 
             else:
-               print(k.len_from_pose(k.inverse_kinematics(request)))
+               distances = k.len_from_pose(k.inverse_kinematics(request))
+               print(distances)
+               renderer.update(k.pose, cfg.BASE_POS, k.percent_from_len(distances))
         else:
            print("expected 3 translation values in mm and 3 rotations values in radians")
     
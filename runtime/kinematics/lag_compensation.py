@@ -0,0 +1,101 @@
+""" lag_compensation
+Lookahead compensation of the pneumatic lag of each muscle on rides whose telemetry is known in advance
+
+The muscles respond tens of milliseconds after a change in commanded pressure. On deterministic rides the
+ sim can supply frames ahead of the one being displayed (read_ahead), these are run through the normal
+ pipeline so the actuator distances of future frames are available. LagCompensator keeps them in a small
+ ring buffer and outputs each muscle's distance from the frame its lag ahead of the visuals, interpolating
+ between frames for lags that are not a whole number of frame periods. The control rate is unchanged.
+
+The lag of each muscle is estimated from a log of commanded and measured values by cross-correlating the
+ frame to frame changes of the two signals, computed for all six muscles at once with FFTs and refined to a
+ fraction of a sample. The log should contain varied motion: the column names default to those of the
+ pressure sweep logs of output/d_to_p_prep.py, but steady ramps only show the lag where they reverse.
+
+Run from the runtime directory to estimate lags for the platform config ACTUATOR_LAGS value:
+    python -m kinematics.lag_compensation calibration/response_log.csv --command p --response d
+"""
+
+import math
+import argparse
+import numpy as np
+
+import logging
+log = logging.getLogger(__name__)
+
+def estimate_lags(commanded, measured, sample_period, max_lag):
+    # returns the lag in seconds of each column of measured behind the same column of commanded
+    # commanded and measured are (samples, actuators) arrays logged at the given period, max_lag is in seconds
+    commanded = np.diff(np.asarray(commanded, dtype=float), axis=0)
+    measured = np.diff(np.asarray(measured, dtype=float), axis=0)
+    commanded -= commanded.mean(axis=0)
+    measured -= measured.mean(axis=0)
+    nbr_samples = len(commanded)
+    size = 1 << (2 * nbr_samples - 1).bit_length() # zero padded so the correlation does not wrap
+    spectrum = np.conj(np.fft.rfft(commanded, size, axis=0)) * np.fft.rfft(measured, size, axis=0)
+    correlation = np.fft.irfft(spectrum, size, axis=0)
+    max_shift = min(int(math.ceil(max_lag / sample_period)), nbr_samples - 2)
+    window = correlation[:max_shift + 2] # shifts 0 to max_shift, plus one for refinement
+    shifts = window[:max_shift + 1].argmax(axis=0)
+    # parabolic interpolation through the peak and its neighbours
+    columns = np.arange(window.shape[1])
+    centre = window[shifts, columns]
+    before = window[np.maximum(shifts - 1, 0), columns]
+    after = window[shifts + 1, columns]
+    curvature = before - 2 * centre + after
+    with np.errstate(divide='ignore', invalid='ignore'): # flat peaks are not refined
+        offset = np.where((shifts > 0) & (curvature < 0), 0.5 * (before - after) / curvature, 0)
+    return (shifts + offset) * sample_period
+
+class LagCompensator(object):
+    def __init__(self, lags, frame_period):
+        # lags are the seconds each muscle lags its command, frame_period is the seconds between frames
+        self.lags = np.clip(np.asarray(lags, dtype=float), 0, None)
+        self.frame_period = frame_period
+        self.lookahead = int(math.ceil(self.lags.max() / frame_period)) # frames ahead the sim must supply
+        self.buffer = np.zeros((self.lookahead + 1, 6)) # ring buffer of distances of the most recent frames
+        self.head = 0 # row of the newest frame
+        # frames back from the newest frame to the one each muscle outputs, split into whole and fraction
+        delay = self.lookahead - self.lags / frame_period
+        self.delay_frames = np.floor(delay).astype(int)
+        self.delay_frac = delay - self.delay_frames
+        self.actuators = np.arange(6)
+        log.info("lag compensation %d frames lookahead, lags %s ms", self.lookahead, np.round(self.lags * 1000).astype(int).tolist())
+
+    def reset(self, distances):
+        # fills the buffer with the given distances, call when the platform is enabled
+        self.buffer[:] = distances
+
+    def push(self, distances):
+        # adds distances of the frame lookahead frames ahead of the visuals
+        # returns the distances to output now, each muscle taken from the frame its lag ahead of the visuals
+        size = len(self.buffer)
+        self.head = (self.head + 1) % size
+        self.buffer[self.head] = distances
+        rows = (self.head - self.delay_frames) % size
+        older = self.buffer[(rows - 1) % size, self.actuators]
+        newer = self.buffer[rows, self.actuators]
+        return newer + (older - newer) * self.delay_frac
+
+def man():
+    parser = argparse.ArgumentParser(description='Estimate the lag of each muscle from a log of command and response')
+    parser.add_argument("log", help="csv file with a header row naming the columns, '#' lines are skipped")
+    parser.add_argument("--command", default='p', help="prefix of the six command columns (default p)")
+    parser.add_argument("--response", default='d', help="prefix of the six response columns (default d)")
+    parser.add_argument("--time", default='time', help="name of the time column in seconds")
+    parser.add_argument("--max_lag", type=float, default=0.5, help="largest lag searched in seconds")
+    return parser
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    args = man().parse_args()
+    with open(args.log) as f:
+        header = [line for line in f if not line.startswith('#')][0].strip().split(',')
+    data = np.genfromtxt(args.log, delimiter=',', comments='#', skip_header=1)
+    data = data[~np.isnan(data).any(axis=1)]
+    commanded = data[:, [header.index(args.command + str(i)) for i in range(6)]]
+    measured = data[:, [header.index(args.response + str(i)) for i in range(6)]]
+    period = np.median(np.diff(data[:, header.index(args.time)]))
+    lags = estimate_lags(commanded, measured, period, args.max_lag)
+    print(format("sample period %.1f ms, lags in ms: %s" % (period * 1000, ', '.join(format("%.0f" % (l * 1000)) for l in lags))))
+    print(format("self.ACTUATOR_LAGS = [%s]" % ', '.join(format("%.3f" % l) for l in lags)))
@@ -1,6 +1,10 @@
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
 import math
+import os
+import numpy as np
 
 def point_at_distance(slider_angles, idx, d, slider_origin):
     # returns the location using the base reference frame when the given slider moves distance d
@@ -150,45 +154,120 @@ def plot_actuator(slider_endpoints, top_point, slider_pos):
    
        plt.show()
 
-class Plot3dCarriages:
-    def __init__(self, cfg, slider_points):
-        fig = plt.figure()
-        self.ax = fig.add_subplot(111, projection='3d')
-        plt.ion()
+class PoseRenderer(object):
+    # incremental 3d renderer for streaming poses
+    # the static geometry (sliders or base points, axes, labels) is drawn once and saved as a background,
+    #   each update restores the background and draws only the platform, strut and text artists (blitting)
+    # headless renders to an Agg canvas without a display, use save_frame to write each frame to an image file
+    def __init__(self, cfg, slider_endpoints=None, headless=False):
         self.cfg = cfg
-        self.slider = slider_points
-        
-    def plot(self, pose, carriage_points,):
-        plt.cla()
-        for i in range(6):
-            a = pose[i]
-            if i == 5:
-                b = pose[0]
-            else:
-                b = pose[i+1]
-            self.ax.plot( [a[0],b[0]], [a[1],b[1]],[a[2],b[2]], 'black')
+        self.headless = headless
+        if headless:
+            self.fig = Figure()
+            FigureCanvasAgg(self.fig)
+        else:
+            plt.ion()
+            self.fig = plt.figure()
+        self.canvas = self.fig.canvas
+        self.ax = self.fig.add_subplot(111, projection='3d')
+        ax = self.ax
+        if slider_endpoints is not None:
+            for i in range(6):
+                ax.plot([slider_endpoints[i][0][0], slider_endpoints[i][1][0]],[slider_endpoints[i][0][1], slider_endpoints[i][1][1]],[0,0],'black')
+        else:
+            ax.scatter(cfg.BASE_POS[:,0], cfg.BASE_POS[:,1], cfg.BASE_POS[:,2], color='black')
+        # fixed limits so the background stays valid, autoscaling would move the axes every frame
+        extent = np.abs(np.concatenate((cfg.BASE_POS, cfg.PLATFORM_POS))[:, :2]).max() + cfg.limits_1dof[0]
+        ax.set_xlim3d(-extent, extent)
+        ax.set_ylim3d(-extent, extent)
+        if cfg.PLATFORM_MID_HEIGHT < 0:
+            zlimit = (-cfg.limits_1dof[2] + cfg.PLATFORM_MID_HEIGHT,0)
+        else:
+            zlimit = (0, cfg.limits_1dof[2] + cfg.PLATFORM_MID_HEIGHT)
+        ax.set_zlim3d(zlimit)
+        ax.set_autoscale_on(False)
+        ax.set_xlabel('X Movement')
+        ax.set_ylabel('Y Movement')
+        ax.set_zlabel('Z Movement')
+        ax.set_title(cfg.PLATFORM_NAME)
+        # dynamic artists, animated so they are left out of the background
+        self.platform_line, = ax.plot([], [], [], 'black', animated=True)
+        self.strut_lines = [ax.plot([], [], [], label=str(i), animated=True)[0] for i in range(6)]
+        ax.legend(handles=self.strut_lines)
+        self.text = self.fig.text(.5, .02, '', ha='center', animated=True)
+        self.artists = [self.platform_line] + self.strut_lines + [self.text]
+        self.background = None
+        self.canvas.mpl_connect('draw_event', self.on_draw) # background is recaptured after a resize or rotation
+        self.canvas.draw()
+        if not headless:
+            plt.show(block=False)
 
-        for i in range(6):
-            self.ax.plot([self.slider[i][0][0], self.slider[i][1][0]],[self.slider[i][0][1], self.slider[i][1][1]],[0,0],'black')
+    def on_draw(self, event):
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self.draw_artists()
 
-        for i in range(6):
-            a = pose[i]
-            b = carriage_points[i]
-            self.ax.plot( [a[0],b[0]], [a[1],b[1]],[a[2],b[2]], label = str(i))
-            self.ax.legend()
+    def draw_artists(self):
+        for artist in self.artists:
+            self.fig.draw_artist(artist)
 
-        self.ax.set_xlabel('X Movement')
-        self.ax.set_ylabel('Y Movement')
-        self.ax.set_zlabel('Z Movement')
-        if self.cfg.PLATFORM_MID_HEIGHT < 0:
-            zlimit = (-self.cfg.limits_1dof[2] + self.cfg.PLATFORM_MID_HEIGHT,0)
-        else:
-            zlimit = (0, self.cfg.limits_1dof[2] + self.cfg.PLATFORM_MID_HEIGHT)
-        self.ax.set_zlim3d(zlimit)
-        self.ax.set_title(self.cfg.PLATFORM_NAME)
+    def update(self, pose, lower_points, percents=None):
+        # pose: (6, 3) platform attachment points, lower_points: (6, 3) carriage or base attachment points
+        pose = np.asarray(pose)
+        ring = pose[[0, 1, 2, 3, 4, 5, 0]]
+        self.platform_line.set_data_3d(ring[:,0], ring[:,1], ring[:,2])
+        for i, line in enumerate(self.strut_lines):
+            line.set_data_3d([pose[i][0], lower_points[i][0]], [pose[i][1], lower_points[i][1]], [pose[i][2], lower_points[i][2]])
+        if percents is not None:
+            self.text.set_text('Actuator movement: ' + '%  '.join(format("%.1f" % p) for p in percents) + '%')
+        self.canvas.restore_region(self.background)
+        self.draw_artists()
+        if not self.headless:
+            self.canvas.blit(self.fig.bbox)
+            self.canvas.flush_events()
+
+    def save_frame(self, fname):
+        # writes the current frame as an image, the type is given by the file extension
+        plt.imsave(fname, np.asarray(self.canvas.buffer_rgba()))
 
-        plt.show()
-        plt.pause(0.01)
+def read_capture(fname):
+    # returns (N, 6, 3) poses and (N, 6) distances from a csv file captured by SimInterface (see SimInterface.echo)
+    poses = []
+    distances = []
+    with open(fname) as f:
+        for line in f:
+            fields = line.strip().split(',')
+            if len(fields) < 21 or fields[0] != 'request':
+                continue # header or partial line
+            distances.append([float(d) for d in fields[8:14]])
+            poses.append([[float(v) for v in point.split(';')] for point in fields[15:21]])
+    return np.array(poses), np.array(distances)
+
+def render_capture(cfg, k, fname, out_dir, every=1):
+    # headless batch render of a captured ride to numbered png frames in out_dir
+    # k is a Kinematics instance set for the platform in cfg, used to find the slider carriage positions
+    poses, distances = read_capture(fname)
+    poses = poses[::every]
+    percents = distances[::every] * 100.0 / k.actuator_range
+    if cfg.PLATFORM_TYPE == "SLIDER":
+        dist, lower_points = k.slider_pos_from_poses(poses)
+        renderer = PoseRenderer(cfg, k.slider_endpoints, headless=True)
+    else:
+        lower_points = np.broadcast_to(cfg.BASE_POS, poses.shape)
+        renderer = PoseRenderer(cfg, headless=True)
+    os.makedirs(out_dir, exist_ok=True)
+    for i in range(len(poses)):
+        renderer.update(poses[i], lower_points[i], percents[i])
+        renderer.save_frame(os.path.join(out_dir, format("frame_%05d.png" % i)))
+    return len(poses)
+
+class Plot3dCarriages:
+    # console plot of slider carriages, uses PoseRenderer so only the moving parts are redrawn
+    def __init__(self, cfg, slider_points):
+        self.renderer = PoseRenderer(cfg, slider_points)
+        
+    def plot(self, pose, carriage_points,):
+        self.renderer.update(pose, carriage_points)
+        plt.pause(0.001)
 
 def plot3d_carriages(cfg, pose, carriage_points, slider_points, percents):
     fig = plt.figure()
@@ -281,4 +360,33 @@ def plot3d(cfg, pose):
         zlimit = (0, cfg.limits_1dof[2] + cfg.PLATFORM_MID_HEIGHT)
     ax.set_zlim3d(zlimit)
     ax.set_title(cfg.PLATFORM_NAME)
-    plt.show()
\ No newline at end of file
+    plt.show()
+
+
+if __name__ == "__main__":
+    # renders a captured ride csv to image frames without a display, run from the kinematics directory:
+    #   python plot_config.py ride.csv frames --chair
+    import argparse
+    import time
+    from kinematicsV2 import Kinematics
+    parser = argparse.ArgumentParser(description='Render captured poses to image frames')
+    parser.add_argument("csv", help="csv file captured by SimInterface")
+    parser.add_argument("out_dir", help="directory for the frames")
+    parser.add_argument("--chair", action='store_true', help="use the chair config (default is the slider)")
+    parser.add_argument("--every", type=int, default=1, help="render every nth captured pose")
+    args = parser.parse_args()
+    if args.chair:
+        from cfg_SuspendedChair import PlatformConfig
+    else:
+        from cfg_SlidingActuators import PlatformConfig
+    cfg = PlatformConfig()
+    cfg.calculate_coords()
+    k = Kinematics()
+    k.set_geometry(cfg.BASE_POS, cfg.PLATFORM_POS)
+    if cfg.PLATFORM_TYPE == "SLIDER":
+        k.set_slider_params(cfg.joint_min_offset, cfg.joint_max_offset, cfg.strut_length, cfg.slider_angles, cfg.slider_endpoints)
+    else:
+        k.set_platform_params(cfg.MIN_ACTUATOR_LEN, cfg.MAX_ACTUATOR_LEN, cfg.FIXED_LEN)
+    start = time.time()
+    frames = render_capture(cfg, k, args.csv, args.out_dir, args.every)
+    print(format("rendered %d frames in %.1f seconds" % (frames, time.time() - start)))
@@ -0,0 +1,93 @@
+""" trajectory
+Slow moves of the platform (enable, disable, swell for access) executed one sample per control tick
+
+A move is precomputed as arrays of actuator distances and echo transforms following an S-curve
+ (minimum jerk quintic) so the muscles start and stop smoothly, its duration is chosen so the fastest
+ actuator peaks at the requested rate. Moves and holds can be queued as segments of one trajectory.
+The caller's timer calls step each tick to get the next sample, so the GUI, telemetry and remote
+ controls keep being serviced while the platform moves.
+Starting a new trajectory or calling cancel pre-empts the current one, the completion callback is
+ called with True when the last sample has been returned or False if the trajectory was pre-empted.
+
+    executor = TrajectoryExecutor(.05)
+    executor.start([executor.move(begin, end, begin_xform, end_xform, 100)], on_complete, (begin, begin_xform))
+    if executor.is_active():
+        distances, xform = executor.step()  # call once per tick
+"""
+
+import math
+import numpy as np
+
+import logging
+log = logging.getLogger(__name__)
+
+PEAK_VELOCITY_RATIO = 1.875 # peak to mean velocity of the minimum jerk profile
+
+class TrajectoryExecutor(object):
+    def __init__(self, frame_period=0.05):
+        self.frame_period = frame_period # seconds between calls to step
+        self.distances = None # (samples, 6) actuator distances of the active trajectory, None when idle
+        self.xforms = None # (samples, 6) transforms echoed with each sample
+        self.index = 0 # next sample
+        self.on_complete = None
+        self.position = None # distances of the most recent sample, the begin position before the first step
+        self.xform = None
+
+    def s_curve(self, nbr_samples):
+        # returns fraction of the move completed at each sample, ending at 1
+        u = np.arange(1, nbr_samples + 1) / nbr_samples
+        return u * u * u * (10 - u * (15 - 6 * u))
+
+    def move(self, begin_dist, end_dist, begin_xform, end_xform, rate_mm_per_sec):
+        # returns (distances, xforms) segment moving from begin to end with peak actuator velocity of the given rate
+        begin_dist, end_dist = np.asarray(begin_dist, dtype=float), np.asarray(end_dist, dtype=float)
+        begin_xform, end_xform = np.asarray(begin_xform, dtype=float), np.asarray(end_xform, dtype=float)
+        distance = np.abs(end_dist - begin_dist).max()
+        nbr_samples = max(int(math.ceil(PEAK_VELOCITY_RATIO * distance / rate_mm_per_sec / self.frame_period)), 1)
+        s = self.s_curve(nbr_samples)[:, np.newaxis]
+        return begin_dist + (end_dist - begin_dist) * s, begin_xform + (end_xform - begin_xform) * s
+
+    def hold(self, distances, xform, seconds):
+        # returns segment holding the given position for the given time
+        nbr_samples = max(int(round(seconds / self.frame_period)), 1)
+        return np.tile(np.asarray(distances, dtype=float), (nbr_samples, 1)), np.tile(np.asarray(xform, dtype=float), (nbr_samples, 1))
+
+    def start(self, segments, on_complete=None, begin=None):
+        # starts a trajectory from a list of (distances, xforms) segments, pre-empting any active trajectory
+        # begin is the (distances, xform) the platform starts from, position and xform report it until the first
+        #  step so a trajectory pre-empted before its first tick restarts from where the platform is.
+        #  If not given the first sample is used
+        self.cancel()
+        self.distances = np.concatenate([segment[0] for segment in segments])
+        self.xforms = np.concatenate([segment[1] for segment in segments])
+        self.index = 0
+        self.on_complete = on_complete
+        if begin is None:
+            begin = self.distances[0], self.xforms[0]
+        self.position = np.asarray(begin[0], dtype=float).tolist()
+        self.xform = np.asarray(begin[1], dtype=float).tolist()
+        log.debug("trajectory started, %d samples", len(self.distances))
+
+    def is_active(self):
+        return self.distances is not None
+
+    def step(self):
+        # returns distances and transform of the next sample as lists, completes the trajectory after its last sample
+        self.position = self.distances[self.index].tolist()
+        self.xform = self.xforms[self.index].tolist()
+        self.index += 1
+        if self.index >= len(self.distances):
+            self.finish(True)
+        return self.position, self.xform
+
+    def cancel(self):
+        if self.is_active():
+            log.debug("trajectory pre-empted at sample %d of %d", self.index, len(self.distances))
+            self.finish(False)
+
+    def finish(self, completed):
+        # state is cleared before the callback so it can start another trajectory
+        on_complete = self.on_complete
+        self.distances, self.xforms, self.on_complete = None, None, None
+        if on_complete:
+            on_complete(completed)
@@ -0,0 +1,161 @@
+""" workspace_analysis
+Offline sweep of the reachable workspace of the chair or slider platform
+
+Derives values for limits_1dof and limits_6dof in the platform config files from the geometry:
+  limits_1dof: the furthest each DOF can move from the origin on its own, found along a dense line for each direction
+  limits_6dof: the largest fraction of limits_1dof for which every point of a 6-D grid spanning the box is reachable,
+    the grid is solved with the batch kinematics spread over a process pool
+The boundary table gives the reachable fraction of limits_1dof along each axis pair diagonal, showing which
+ combinations of DOF limit the combined envelope.
+
+Run from the runtime directory:
+    python -m kinematics.workspace_analysis slider --points 9
+    python -m kinematics.workspace_analysis chair --processes 8
+"""
+
+import os
+import sys
+import math
+import time
+import argparse
+import itertools
+import importlib
+from multiprocessing import Pool
+import numpy as np
+
+from kinematics.kinematicsV2 import Kinematics
+
+import logging
+log = logging.getLogger(__name__)
+
+config_modules = {'slider': 'kinematics.cfg_SlidingActuators', 'chair': 'kinematics.cfg_SuspendedChair'}
+DOF_NAMES = ('surge', 'sway', 'heave', 'roll', 'pitch', 'yaw')
+LINE_SAMPLES = 4000 # samples along each line searched for the single DOF and diagonal limits
+CHUNK_SIZE = 20000 # grid points solved by each pool task
+BISECTION_STEPS = 10
+
+k = None # Kinematics instance of each worker process, set by init_worker
+
+def make_kinematics(platform):
+    # returns the platform config and a Kinematics instance set for it
+    cfg = importlib.import_module(config_modules[platform]).PlatformConfig()
+    cfg.calculate_coords()
+    kinematics = Kinematics()
+    kinematics.set_geometry(cfg.BASE_POS, cfg.PLATFORM_POS)
+    if cfg.PLATFORM_TYPE == "SLIDER":
+        kinematics.set_slider_params(cfg.joint_min_offset, cfg.joint_max_offset, cfg.strut_length, cfg.slider_angles, cfg.slider_endpoints)
+    else:
+        kinematics.set_platform_params(cfg.MIN_ACTUATOR_LEN, cfg.MAX_ACTUATOR_LEN, cfg.FIXED_LEN)
+    return cfg, kinematics
+
+def init_worker(platform):
+    global k
+    _, k = make_kinematics(platform)
+
+def grid_chunk(args):
+    # returns True if every point of the given slice of the grid is reachable
+    axes, start, stop = args
+    indices = np.unravel_index(np.arange(start, stop), [len(a) for a in axes])
+    requests = np.stack([axes[i][indices[i]] for i in range(6)], axis=-1)
+    return bool(k.is_reachable(requests).all())
+
+def reach_along(kinematics, direction, span):
+    # returns the largest t in 0..1 such that every request t' * span * direction for t' <= t is reachable
+    t = np.linspace(0, 1, LINE_SAMPLES)
+    reachable = kinematics.is_reachable(t[:, np.newaxis] * (np.asarray(direction) * span))
+    if reachable.all():
+        return 1.0
+    return t[max(np.argmin(reachable) - 1, 0)]
+
+def single_dof_limits(kinematics, span):
+    # returns (6, 2) array of the reachable negative and positive extent of each DOF on its own
+    limits = np.zeros((6, 2))
+    for dof in range(6):
+        for side, sign in enumerate((-1, 1)):
+            direction = np.zeros(6)
+            direction[dof] = sign
+            limits[dof, side] = reach_along(kinematics, direction, span) * span[dof]
+    return limits
+
+def boundary_table(kinematics, limits_1dof):
+    # returns rows of (dof a, dof b, reachable fraction) for the four diagonals of each pair of DOF
+    rows = []
+    for a, b in itertools.combinations(range(6), 2):
+        fractions = []
+        for signs in itertools.product((-1, 1), repeat=2):
+            direction = np.zeros(6)
+            direction[a], direction[b] = signs
+            fractions.append(reach_along(kinematics, direction, limits_1dof))
+        rows.append((a, b, min(fractions)))
+    return rows
+
+def box_is_reachable(pool, limits, points, wave):
+    # True if every point of a grid with the given number of points per DOF spanning +- limits is reachable
+    # chunks are submitted in waves so the search stops soon after the first unreachable chunk
+    axes = [np.linspace(-l, l, points) for l in limits]
+    total = points ** 6
+    tasks = [(axes, start, min(start + CHUNK_SIZE, total)) for start in range(0, total, CHUNK_SIZE)]
+    for first in range(0, len(tasks), wave):
+        if not all(pool.map(grid_chunk, tasks[first:first + wave])):
+            return False
+    return True
+
+def combined_fraction(pool, limits_1dof, points, wave):
+    # bisects for the largest fraction of limits_1dof whose whole grid is reachable
+    lo, hi = 0.0, 1.0
+    if box_is_reachable(pool, limits_1dof, points, wave):
+        return 1.0
+    for step in range(BISECTION_STEPS):
+        mid = (lo + hi) / 2
+        if box_is_reachable(pool, limits_1dof * mid, points, wave):
+            lo = mid
+        else:
+            hi = mid
+        log.info("combined fraction between %.3f and %.3f", lo, hi)
+    return lo
+
+def format_limits(name, limits):
+    values = [format("%.0f" % l) for l in limits[:3]] + [format("math.radians(%.1f)" % math.degrees(l)) for l in limits[3:]]
+    return format("self.%s = [%s]" % (name, ", ".join(values)))
+
+def analyse(platform, points, span_factor, processes):
+    cfg, kinematics = make_kinematics(platform)
+    # search well beyond the configured limits so the sweep is not bounded by them
+    span = np.asarray(cfg.limits_1dof, dtype=float) * span_factor
+    start = time.time()
+    extents = single_dof_limits(kinematics, span)
+    limits_1dof = np.abs(extents).min(axis=1) # config limits are symmetric
+    print("single DOF envelope (negative, positive):")
+    for dof in range(6):
+        scale = 1 if dof < 3 else 180 / math.pi
+        units = 'mm' if dof < 3 else 'deg'
+        print(format("  %-6s %8.1f %8.1f %s   config %.1f" % (DOF_NAMES[dof], extents[dof, 0] * scale, extents[dof, 1] * scale,
+                                                                 units, cfg.limits_1dof[dof] * scale)))
+    if not processes:
+        processes = os.cpu_count() or 1
+    with Pool(processes, initializer=init_worker, initargs=(platform,)) as pool:
+        fraction = combined_fraction(pool, limits_1dof, points, processes * 2)
+    limits_6dof = limits_1dof * fraction
+    print(format("combined envelope is %.3f of the single DOF envelope (%d points per DOF)" % (fraction, points)))
+    print("boundary table, reachable fraction of limits_1dof along each pair diagonal:")
+    table = boundary_table(kinematics, limits_1dof)
+    for a, b, reach in sorted(table, key=lambda row: row[2]):
+        print(format("  %-6s + %-6s %.3f" % (DOF_NAMES[a], DOF_NAMES[b], reach)))
+    print("suggested config values:")
+    print("  " + format_limits('limits_1dof', limits_1dof))
+    print("  " + format_limits('limits_6dof', limits_6dof))
+    print(format("analysis took %.1f seconds" % (time.time() - start)))
+    return limits_1dof, limits_6dof, table
+
+def man():
+    parser = argparse.ArgumentParser(description='Derive platform workspace limits from the geometry')
+    parser.add_argument("platform", choices=sorted(config_modules), help="platform config to analyse")
+    parser.add_argument("-p", "--points", type=int, default=9, help="grid points per DOF for the combined envelope")
+    parser.add_argument("-s", "--span", type=float, default=1.5, help="search span as a multiple of the configured limits_1dof")
+    parser.add_argument("-n", "--processes", type=int, default=None, help="worker processes (default is one per cpu)")
+    return parser
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)-8s %(message)s', datefmt='%H:%M:%S')
+    args = man().parse_args()
+    analyse(args.platform, args.points, args.span, args.processes)
@@ -11,22 +11,183 @@ The D_to_P  class is instantiated with an argument specifying the number of dist
 
     load_DtoP(fname) loads distance to pressure lookup tables
        returns True if valid data has been loaded 
+       The csv file is compiled to a binary .npy file in dtop_cache (with a .json file of its metadata) that is
+        memory mapped read-only by load, so processes using the same table share one copy. The binary file is
+        rebuilt automatically when the csv file changes (checked by modification time, then by sha1 hash)
        If successful, the lookup tables are available as class attributes named d_to_p_up  and d_to_p_down.
        It is expected that each up and down table will have six to ten rows containing data for the range of working loads 
        the set_index method described below is used to determine the curve that best fits the current platform load
 
     set_index(self, pressure, distances, dir)
-       Finds closest curve matching the current distance and pressure, or none if data available
+       Finds the fractional curve index of each muscle matching the current distance and pressure
        These curves should be passed to the festo output module for runtime conversion
+    set_payload(payload_kg) selects the curves for a payload using the weights in the table header
+     (payload_estimator.py selects them from the pressures measured while the platform is at the load position)
+
+    distance_to_pressure(distances)
+       returns a numpy int array of the six pressures for the given float distances, interpolated between distance columns
+        and blending load curves by the fractional curve index
+       each actuator keeps its own up/down direction state so only that muscle's motion selects its curve set
+    pressures_for_frames(frames) is the vectorized equivalent for an array of consecutive frames
+    set_correction(correction) sets offsets added to the output, see valve_bias.py
+    interpolate(index, distances, curve_sets) returns the bilinear load x distance pressure for arrays of values
+
+    load(fname, 'spline') fits a SplineModel to the tables and uses it in place of the table lookups:
+       monotone piecewise cubic curves (Fritsch-Carlson) on knots shared by all curves of the table,
+       knots are added where the fit is worst until every table value is within FIT_TOLERANCE.
+       The model is a few hundred coefficients per table and is evaluated with Horner's rule,
+       blending coefficients of adjacent load curves is the same as blending the curves
        
 Utility methods to create the distance to pressure files are in d_to_p_prep.py
 
 """
 import os
+import json
+import bisect
+import hashlib
 import traceback
 import numpy as np
 
+import logging
+log = logging.getLogger(__name__)
+
 NBR_DISTANCES = 201 # 0-200mm with precision of 1mm
+TABLE_VERSION = 1 # increment if the compiled table format changes
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dtop_cache')
+FIT_TOLERANCE = 10 # max difference in pressure units between a fitted spline and the table
+MAX_KNOTS = 64
+
+def file_sha1(fname):
+    h = hashlib.sha1()
+    with open(fname, 'rb') as f:
+        for block in iter(lambda: f.read(65536), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def read_weights(fname):
+    # returns list of payload weights from the '# weights,40,80' header line, empty list if no header
+    with open(fname) as f:
+        header = f.readline().lstrip('#').split(',')
+    if header[0].strip() != 'weights':
+        return []
+    return [float(w) for w in header[1:] if w.strip()]
+
+def cache_names(fname, cache_dir=CACHE_DIR):
+    # returns names of the compiled table and its metadata, the name includes a hash of the csv path
+    path_hash = hashlib.sha1(os.path.abspath(fname).encode()).hexdigest()[:8]
+    base = os.path.join(cache_dir, os.path.splitext(os.path.basename(fname))[0] + '_' + path_hash)
+    return base + '.npy', base + '.json'
+
+def compile_table(fname, cache_dir=CACHE_DIR):
+    # parses the csv file and writes the (2, rows, NBR_DISTANCES) up and down curves and metadata to cache_dir
+    # files are written under temporary names and renamed so other processes never map a partial table
+    table_name, meta_name = cache_names(fname, cache_dir)
+    stat = os.stat(fname)
+    d_to_p = np.loadtxt(fname, delimiter=',', dtype=np.int32)
+    if d_to_p.ndim != 2 or d_to_p.shape[1] != NBR_DISTANCES:
+        raise ValueError(format("expected %d columns in %s, found shape %s" % (NBR_DISTANCES, fname, str(d_to_p.shape))))
+    if len(d_to_p) % 2:
+        raise ValueError("up and down DtoP rows don't match")
+    curves = np.stack(np.split(d_to_p, 2))
+    meta = {'version': TABLE_VERSION, 'source': os.path.abspath(fname), 'mtime_ns': stat.st_mtime_ns,
+            'size': stat.st_size, 'sha1': file_sha1(fname), 'weights': read_weights(fname), 'shape': list(curves.shape)}
+    os.makedirs(cache_dir, exist_ok=True)
+    pid = str(os.getpid())
+    with open(table_name + pid, 'wb') as f:
+        np.save(f, curves)
+    os.replace(table_name + pid, table_name)
+    write_meta(meta_name, meta)
+    log.info("compiled distance to pressure table %s to %s", fname, table_name)
+    return curves, meta
+
+def write_meta(meta_name, meta):
+    tmp_name = meta_name + str(os.getpid())
+    with open(tmp_name, 'w') as f:
+        json.dump(meta, f, indent=2)
+    os.replace(tmp_name, meta_name)
+
+def load_table(fname, cache_dir=CACHE_DIR):
+    # returns read-only memory mapped (2, rows, NBR_DISTANCES) curves and the metadata for the given csv file
+    # the compiled table is rebuilt if missing or if the csv contents have changed
+    table_name, meta_name = cache_names(fname, cache_dir)
+    stat = os.stat(fname)
+    try:
+        with open(meta_name) as f:
+            meta = json.load(f)
+        if meta['version'] != TABLE_VERSION:
+            raise ValueError("table version changed")
+        if meta['mtime_ns'] != stat.st_mtime_ns or meta['size'] != stat.st_size:
+            # the file was touched, only rebuild if the contents are different
+            if meta['sha1'] != file_sha1(fname):
+                raise ValueError("csv file changed")
+            meta['mtime_ns'], meta['size'] = stat.st_mtime_ns, stat.st_size
+            write_meta(meta_name, meta)
+        curves = np.load(table_name, mmap_mode='r')
+        if list(curves.shape) != meta['shape']:
+            raise ValueError("unexpected table shape")
+        return curves, meta
+    except (IOError, ValueError, KeyError) as e:
+        log.info("building distance to pressure table for %s (%s)", fname, e)
+    try:
+        compile_table(fname, cache_dir)
+        return np.load(table_name, mmap_mode='r'), read_meta(meta_name)
+    except IOError as e:
+        # cache directory not writable, use the parsed table without caching
+        log.warning("unable to cache distance to pressure table: %s", e)
+        curves = np.stack(np.split(np.loadtxt(fname, delimiter=',', dtype=np.int32), 2))
+        return curves, {'weights': read_weights(fname), 'shape': list(curves.shape)}
+
+def read_meta(meta_name):
+    with open(meta_name) as f:
+        return json.load(f)
+
+class SplineModel(object):
+    # monotone cubic spline fit of the up and down distance to pressure curves
+
+    def __init__(self):
+        self.knots = None # distances in mm of the knots, shared by all curves
+        self.coefficients = None # (2, rows, knots-1, 4) cubic, quadratic, linear and constant term of each segment
+
+    def fit(self, curves, tolerance=FIT_TOLERANCE, max_knots=MAX_KNOTS):
+        # fits (2, rows, columns) curves, returns the max error in pressure units
+        # knots start at the ends of the table, the column with the largest error is added until within tolerance
+        curves = np.asarray(curves, dtype=float)
+        distances = np.arange(curves.shape[-1], dtype=float)
+        knots = [0, curves.shape[-1] - 1]
+        while True:
+            self.knots = np.array(sorted(knots), dtype=float)
+            self.coefficients = self.segment_coefficients(self.knots, curves[..., self.knots.astype(int)])
+            fitted = self.evaluate(np.arange(2)[:, np.newaxis, np.newaxis], np.arange(curves.shape[1])[:, np.newaxis], distances)
+            errors = np.abs(fitted - curves).reshape(-1, len(distances)).max(axis=0)
+            if errors.max() <= tolerance or len(knots) >= max_knots:
+                break
+            knots.append(int(errors.argmax()))
+        return errors.max()
+
+    @staticmethod
+    def segment_coefficients(x, y):
+        # cubic hermite coefficients for values y at knots x, slopes are limited so each segment is monotone
+        h = np.diff(x)
+        delta = np.diff(y, axis=-1) / h
+        slopes = np.zeros_like(y)
+        w1 = 2 * h[1:] + h[:-1]
+        w2 = h[1:] + 2 * h[:-1]
+        d0, d1 = delta[..., :-1], delta[..., 1:]
+        with np.errstate(divide='ignore', invalid='ignore'): # flat segments give zero slope in the where below
+            harmonic = (w1 + w2) / (w1 / d0 + w2 / d1)
+        slopes[..., 1:-1] = np.where(d0 * d1 > 0, harmonic, 0)
+        slopes[..., 0] = delta[..., 0]
+        slopes[..., -1] = delta[..., -1]
+        m0, m1 = slopes[..., :-1], slopes[..., 1:]
+        return np.stack(((m0 + m1 - 2 * delta) / h**2, (3 * delta - 2 * m0 - m1) / h, m0, y[..., :-1]), axis=-1)
+
+    def evaluate(self, curve_sets, rows, distances):
+        # returns pressures of the given curves at the given distances, arguments are arrays that broadcast together
+        distances = np.clip(distances, self.knots[0], self.knots[-1])
+        segments = np.minimum(np.searchsorted(self.knots, distances, side='right'), len(self.knots) - 1) - 1
+        t = distances - self.knots[segments]
+        c = self.coefficients[curve_sets, rows, segments]
+        return ((c[..., 0] * t + c[..., 1]) * t + c[..., 2]) * t + c[..., 3]
 
 class D_to_P(object):
 
@@ -35,21 +196,43 @@ class D_to_P(object):
        assert(self.nbr_columns == NBR_DISTANCES), format("Expected %d distance values!" % NBR_DISTANCES)
        self.d_to_p_up = None  # up-going distance to pressure curves - muscles contract
        self.d_to_p_down = None
-       self.up_curve_idx = [0]*6  # index of the up-going curve closest to the current load
-       self.down_curve_idx = [0]*6
-       self.curve_set_direction =  1 # 1 uses up moving curves, -1 down curves
+       self.curves = None # (2, rows, NBR_DISTANCES) array of the up (index 0) and down (index 1) curves
+       # curve index of each muscle for the up (row 0) and down (row 1) curves, the fractional part blends
+       #  between adjacent curves, call update_curve_index after changing these values
+       self.curve_idx = np.zeros((2, 6))
+       self.up_curve_idx = self.curve_idx[0]  # index of the up-going curve closest to the current load
+       self.down_curve_idx = self.curve_idx[1]
+       self.curve_set = [0]*6 # per muscle curve set in use, 0 is up moving curves, 1 down curves
        self.rows = 0 # number of load values in the DtoP file
+       self.weights = [] # payload in kg of each load value
        self.prev_distances = [0]*6
+       # for each muscle and curve set: lower and upper curve as lists and the blend fraction, only the curves
+       #  in use are copied to lists, the full table stays in the shared memory map
+       self.curve_rows = None
+       self.model = None # SplineModel when using fitted curves, None for table lookup
+       self.spline_coefficients = None # for each muscle and curve set: flat list of blended spline coefficients
+       self.correction = None # (2, 6, 2) offset and slope per mm added to the pressure of each curve set and muscle
+       self.correction_terms = None # correction as nested lists used by distance_to_pressure
 
-    def load(self, fname = 'output\DtoP.csv'):
+    def load(self, fname = 'output\DtoP.csv', model = 'table'):
+        # model is 'table' to look up pressures in the tables, 'spline' to use curves fitted to the tables
         print("Using distance to Pressure file:", fname)
-        # initializes d_to_p arrays from data in the given file
+        # initializes d_to_p arrays from data in the given file, using the compiled binary form when up to date
         try:
-            d_to_p = np.loadtxt(fname, delimiter=',', dtype=int)
-            assert(d_to_p.shape[1] == self.nbr_columns), format("expected %d columns, found %d\n", (self.nbr_columns, d_to_p.shape[1]))
-            self.d_to_p_up, self.d_to_p_down =  np.split(d_to_p,2)
-            assert(self.d_to_p_up.shape[0] == self.d_to_p_down.shape[0]), "up and down DtoP rows don't match"
+            self.curves, meta = load_table(fname)
+            assert(self.curves.shape[2] == self.nbr_columns), format("expected %d columns, found %d" % (self.nbr_columns, self.curves.shape[2]))
+            self.d_to_p_up, self.d_to_p_down = self.curves # views of the shared read-only table
             self.rows = self.d_to_p_up.shape[0]
+            self.weights = meta['weights'] # payload of each curve in kg, empty if the file has no weights header
+            if model == 'spline':
+                self.model = SplineModel()
+                error = self.model.fit(self.curves)
+                log.info("fitted %d knot splines to %s, max error %.1f", len(self.model.knots), fname, error)
+            elif model == 'table':
+                self.model = None
+            else:
+                raise ValueError(format("unknown distance to pressure model '%s'" % model))
+            self.update_curve_index()
             self.nbr_distance_columns = self.d_to_p_up.shape[1]
             ##print(self.d_to_p_up)
             ##print(self.d_to_p_down)
@@ -60,95 +243,210 @@ class D_to_P(object):
 
     def set_index(self, pressure, distances, dir):
         # determines index for each muscle with closest up and down curves matching the given pressure and distances
-        # values for each muscle are stored in the up_curve_idx and down_curve_idx lists. 
-        # the integer value indicates the previously loaded d_to_p curves with highest value less than the given pressure at the given distance
-        # todo - the mantissa (fractional part) indicates the ratio of the distance to the difference between the surrounding d_to_p values
+        # returns the six fractional indices (see curve_index), these are also stored in up_curve_idx or down_curve_idx
         if dir == "up":
-            # find distances in each curve closed to the given pressure 
-            print(self.d_to_p_up)
-            distances_in_curves = (np.abs( self.d_to_p_up - pressure)).argmin(axis=1)
-            # now find the curve with the given distance closest to the value returned above
-            self.up_curve_idx = []
-            for i in range(6):
-                self.up_curve_idx.append((np.abs(distances_in_curves - distances[i])).argmin(axis=0))
+            curve_set = 0
         elif dir == "down":
-            distances_in_curves = (np.abs( self.d_to_p_down - pressure)).argmin(axis=1)
-            # find the curve with the given distance closest to the value returned above
-            self.down_curve_idx = []
-            for i in range(6):
-                self.down_curve_idx.append((np.abs(distances_in_curves - distances[i])).argmin(axis=0))
+            curve_set = 1
         else:
             print("invalid direction in set_index")
+            return None
+        index = self.curve_index(pressure, distances, curve_set)
+        self.curve_idx[curve_set] = index
+        self.update_curve_index()
+        return index
+
+    def curve_index(self, pressure, distances, curve_set):
+        # returns the fractional curve index of each muscle matching the given pressure at the given distance
+        # pressure and curve_set are a single value or one per muscle, distances are the six muscle contractions in mm
+        # the integer part of the index is the lower of the two adjacent curves whose pressures at the muscle's distance
+        #  bracket the given pressure, the fractional part is the position of the pressure between them
+        distances = np.asarray(distances, dtype=float)
+        pressure = np.broadcast_to(np.asarray(pressure, dtype=float), (6,))
+        curve_rows = np.arange(self.rows)[:, np.newaxis]
+        # (rows, 6) pressure of every curve at each muscle distance, curves are in order of increasing load
+        curve_pressures = self.interpolate(curve_rows, distances, curve_set)
+        # nearest curve is used where the pressure is outside the range of the loaded curves
+        index = np.abs(curve_pressures - pressure).argmin(axis=0).astype(float)
+        if self.rows > 1:
+            low_pressures, high_pressures = curve_pressures[:-1], curve_pressures[1:]
+            between = ((pressure - low_pressures) * (pressure - high_pressures) <= 0) & (low_pressures != high_pressures)
+            lower = between.argmax(axis=0) # first pair of adjacent curves bracketing the pressure
+            actuators = np.arange(6)
+            low, high = low_pressures[lower, actuators], high_pressures[lower, actuators]
+            with np.errstate(divide='ignore', invalid='ignore'): # equal curves are excluded by the where below
+                frac = (pressure - low) / (high - low)
+            index = np.where(between.any(axis=0), lower + frac, index)
+        return index
+
+    def set_curve_index(self, index):
+        # sets the up and down curve index of each muscle, index is a single value, one per muscle or (2, 6)
+        # the curves used by distance_to_pressure change in one assignment so this can be called from another thread
+        self.curve_idx[:] = np.clip(np.broadcast_to(index, (2, 6)), 0, max(self.rows - 1, 0))
+        self.update_curve_index()
+
+    def payload_to_index(self, payload_kg):
+        # returns the fractional curve index for the given payload using the weights from the table header
+        if self.rows == 1:
+            return np.zeros_like(payload_kg, dtype=float) # a single curve is used for every payload
+        if len(self.weights) != self.rows:
+            raise ValueError("distance to pressure table has no weights for its curves")
+        return np.interp(payload_kg, self.weights, np.arange(self.rows))
+
+    def index_to_payload(self, index):
+        if len(self.weights) != self.rows:
+            raise ValueError("distance to pressure table has no weights for its curves")
+        return np.interp(index, np.arange(self.rows), self.weights)
+
+    def set_payload(self, payload_kg):
+        # selects the curves of every muscle for the given payload
+        self.set_curve_index(self.payload_to_index(payload_kg))
+
+    def update_curve_index(self):
+        # precomputes the curves used by distance_to_pressure from curve_idx
+        # the new curves replace the old in one assignment so this can be called while the platform is moving
+        lower = np.minimum(self.curve_idx.astype(int), self.rows - 1)
+        upper = np.minimum(lower + 1, self.rows - 1)
+        frac = self.curve_idx - lower # zero for whole indices and on the last curve
+        curve_sets = np.arange(2)[:, np.newaxis]
+        curve_lists = {} # each curve in use is copied once, muscles on the same curve share its list
+        def curve_list(curve_set, row):
+            key = (curve_set, int(row))
+            if key not in curve_lists:
+                curve_lists[key] = self.curves[key].tolist()
+            return curve_lists[key]
+        self.curve_rows = [[(curve_list(c, lower[c, i]), curve_list(c, upper[c, i]), float(frac[c, i])) for c in range(2)]
+                           for i in range(6)]
+        if self.model is not None:
+            coefficients = self.model.coefficients[curve_sets, lower], self.model.coefficients[curve_sets, upper]
+            blended = coefficients[0] + (coefficients[1] - coefficients[0]) * frac[..., np.newaxis, np.newaxis]
+            self.spline_coefficients = [[blended[c, i].ravel().tolist() for c in range(2)] for i in range(6)]
+
+    def set_correction(self, correction):
+        # sets the (2, 6, 2) offset and slope of the pressure correction for each curve set and muscle, None to clear
+        # the lists used each frame are replaced in one assignment so this can be called from another thread
+        if correction is None:
+            self.correction, self.correction_terms = None, None
+        else:
+            self.correction = np.array(correction, dtype=float)
+            self.correction_terms = [[tuple(self.correction[c, i]) for c in range(2)] for i in range(6)]
 
     def distance_to_pressure(self, distances):
-        # distances are a list of muscle contractions in mm
-        # threshold_to_swap_dir = 2 
+        # distances are a list or array of muscle contractions in mm, returns numpy int array of the six pressures
+        # pressures are bilinear interpolated between the adjacent load curves and the adjacent distance columns
+        # each muscle swaps to its up (or down) curves when it moves up (or down) more than the threshold
+        # this runs every frame on six values, where plain python on the precomputed curves is faster than numpy calls,
+        #  only the result is converted to an array (a vectorized numpy version measured slower, see __main__)
+        if isinstance(distances, np.ndarray):
+            distances = distances.tolist() # python floats, indexing numpy scalars one at a time is slow
         distance_threshold = 5 # distances must be greater than this to trigger a direction change
-        pressures = []
+        max_column = self.nbr_columns - 1
+        if self.model is not None:
+            knots = self.model.knots.tolist()
+            last_segment = len(knots) - 1
+        correction = self.correction_terms
+        pressures = [0]*6
         for i in range(6):
-            delta = distances[i] - self.prev_distances[i] # delta is mm change in distance
-            if abs(delta) > distance_threshold:
-                if np.sign(delta) != np.sign(self.curve_set_direction):
-                    #here if need to swap up/down curve sets
-                    if delta > 0: # moving up
-                        self.curve_set_direction = 1
-                        self.current_curve_set = self.d_to_p_up
-                        index = self.up_curve_idx[i]
-                    else:
-                        self.curve_set_direction = -1                   
-                        self.current_curve_set = self.d_to_p_down
-                        index = self.down_curve_idx[i]
-            
-            if self.curve_set_direction == 1:  # using up curve
-                curve_set = self.d_to_p_up
-                index = self.up_curve_idx[i]
+            distance = distances[i]
+            delta = distance - self.prev_distances[i]
+            if delta > distance_threshold:
+                self.curve_set[i] = 0
+            elif delta < -distance_threshold:
+                self.curve_set[i] = 1
+            self.prev_distances[i] = distance
+            distance = min(max(distance, 0), max_column)
+            if self.model is not None:
+                # find the spline segment and evaluate its cubic with Horner's rule
+                segment = min(bisect.bisect_right(knots, distance), last_segment) - 1
+                c = self.spline_coefficients[i][self.curve_set[i]]
+                j = segment * 4
+                t = distance - knots[segment]
+                p = ((c[j] * t + c[j+1]) * t + c[j+2]) * t + c[j+3]
             else:
-                curve_set = self.d_to_p_down
-                index = self.down_curve_idx[i]           
-
-            try: 
-                p = self.interpolate(index, distances[i], curve_set) 
-                pressures.append(p)
-            except Exception as e:
-                print("error in distance_to_pressure", e, traceback.format_exc())
-                print("-> Has 'output\DtoP.csv' been loaded?")
-
-        # print pressures
-        self.prev_distances = distances
-        return pressures
-
-    def interpolate(self, index, distance, curves):
-        # return the pressure for the given distance interpolated by the index value
-        if index < self.rows:
-            distance = int(distance)
-            if distance > 200:
-                distance = 200 
-            if distance >= len(curves[int(index)]):
-                distance = len(curves[int(index)]-1)
-            if index >= len(curves[index]):
-               index = len(curves[index])-1
-            if index == int(index) or index >= self.rows -1:
-                try:
-                    return curves[int(index)][distance]
-                except Exception as e:
-                    print(e)
-                    print(index, distance, len(curves[index]))
-            else:
-                frac = index - int(index)
-                #  print("idx=", index, "frac", frac, "dist", distance)
-                delta = curves[int(index+1)][distance]*1.0 -  curves[int(index)][distance]
-                d = curves[int(index)][distance]*1.0  + delta * frac 
-                return d
-        else:
-            log.error("dist to pressure index value out of range")
+                lower, upper, frac = self.curve_rows[i][self.curve_set[i]]
+                column = min(int(distance), max_column - 1)
+                distance_frac = distance - column
+                p = lower[column]
+                p += (lower[column + 1] - p) * distance_frac
+                upper_p = upper[column]
+                upper_p += (upper[column + 1] - upper_p) * distance_frac
+                p += (upper_p - p) * frac
+            if correction is not None:
+                offset, slope = correction[i][self.curve_set[i]]
+                p += offset + slope * distance
+            pressures[i] = round(p)
+        return np.asarray(pressures, dtype=int)
+
+    def pressures_for_frames(self, frames):
+        # returns (N, 6) numpy int array of pressures for an (N, 6) array of consecutive frames of distances
+        # gives the same values as calling distance_to_pressure for each frame, starting from the current state,
+        #  but the state is not changed. Used to process recorded rides and calibration data in one call
+        distance_threshold = 5
+        frames = np.asarray(frames, dtype=float)
+        actuators = np.arange(6)
+        delta = np.diff(frames, axis=0, prepend=[self.prev_distances])
+        flags = np.where(delta > distance_threshold, 0, np.where(delta < -distance_threshold, 1, -1))
+        # curve set of each frame is the flag of the most recent frame that moved more than the threshold
+        last = np.where(flags >= 0, np.arange(len(frames))[:, np.newaxis], -1)
+        np.maximum.accumulate(last, axis=0, out=last)
+        curve_sets = np.where(last >= 0, flags[last, actuators], self.curve_set)
+        index = self.curve_idx[curve_sets, actuators]
+        pressures = self.interpolate(index, frames, curve_sets)
+        correction = self.correction
+        if correction is not None:
+            distances = np.clip(frames, 0, self.nbr_columns - 1)
+            pressures += correction[curve_sets, actuators, 0] + correction[curve_sets, actuators, 1] * distances
+        return np.rint(pressures).astype(int)
+
+    def interpolate(self, index, distances, curve_sets):
+        # returns float pressures bilinear interpolated at the given fractional curve indices and float distances
+        #  (or from the fitted splines when a model is loaded)
+        # arguments are arrays (or values) that broadcast together, curve_sets are 0 for up curves, 1 for down
+        index = np.clip(index, 0, self.rows - 1)
+        lower = np.minimum(np.asarray(index).astype(int), self.rows - 2) if self.rows > 1 else np.zeros_like(index, dtype=int)
+        upper = np.minimum(lower + 1, self.rows - 1)
+        distances = np.clip(distances, 0, self.nbr_columns - 1)
+        columns = np.minimum(np.asarray(distances).astype(int), self.nbr_columns - 2)
+        distance_frac = distances - columns
+        index_frac = index - lower
+        if self.model is not None:
+            low_pressures = self.model.evaluate(curve_sets, lower, distances)
+            return low_pressures + (self.model.evaluate(curve_sets, upper, distances) - low_pressures) * index_frac
+
+        def along_distance(rows):
+            p = self.curves[curve_sets, rows, columns]
+            return p + (self.curves[curve_sets, rows, columns + 1] - p) * distance_frac
+
+        low_pressures = along_distance(lower)
+        return low_pressures + (along_distance(upper) - low_pressures) * index_frac
 
 if __name__ == "__main__":
-    import logging
-    log = logging.getLogger(__name__)
-    logging.basicConfig(format='%(message)s', datefmt='%H:%M:%S')
+    logging.basicConfig(level=logging.INFO, format='%(message)s', datefmt='%H:%M:%S')
 
     d_to_p = D_to_P(200)
-    curves = [[1,2,3,4,5],[6,7,8,9,10], [11,12,13,14,15],  [21,22,23,24,25]]
-    d_to_p.rows = len(curves)
-    print(d_to_p.interpolate(0.9, 1, curves))
-      
+
+    # microbenchmark of distance_to_pressure, run from the runtime directory as: python -m output.d_to_p
+    import time
+    frames = np.random.uniform(0, 200, (10000, 6))
+    curve_idx = None
+    for model in ('table', 'spline'):
+        d_to_p.load(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'DtoP.csv'), model)
+        if curve_idx is None:
+            curve_idx = np.random.uniform(0, d_to_p.rows - 1, (2, 6))
+        d_to_p.curve_idx[:] = curve_idx
+        d_to_p.update_curve_index()
+        d_to_p.prev_distances = [0]*6
+        d_to_p.curve_set = [0]*6
+        start = time.perf_counter()
+        batch = d_to_p.pressures_for_frames(frames)
+        batch_time = time.perf_counter() - start
+        # the slider path passes lists (move_percent), the chair path numpy arrays from the actuator limiter
+        for input_type, inputs in (('list', frames.tolist()), ('array', list(frames))):
+            d_to_p.prev_distances = [0]*6
+            d_to_p.curve_set = [0]*6
+            start = time.perf_counter()
+            pressures = [d_to_p.distance_to_pressure(distances) for distances in inputs]
+            print(format("%s distance_to_pressure, %s input: %.1f us per frame" %
+                         (model, input_type, (time.perf_counter() - start) / len(frames) * 1e6)))
+            assert np.abs(np.array(pressures) - batch).max() <= 1 # float rounding may differ by one
+        print(format("%s pressures_for_frames: %.2f us per frame" % (model, batch_time / len(frames) * 1e6)))
@@ -0,0 +1,217 @@
+""" d_to_p_prep
+Calibration sweeps that create the distance to pressure tables used by d_to_p.py
+
+A sweep ramps the pressure of all six muscles up from zero to max pressure and back down, for a number of
+ cycles, with the platform carrying a known load. Commanded pressures and measured muscle distances are
+ logged at every sample to a csv file per load (sweep_<load>kg.csv).
+The logs are reduced to up and down curves of pressure for each mm of distance, each (log, actuator) pair is
+ reduced in its own task of a process pool. The curves of the six actuators are combined with the median
+ and the tables for all loads are written as a DtoP csv file, which is then compiled to the binary cache.
+A summary chart of the curves and the spread between actuators is rendered with chart.py.
+
+Muscle distances must be supplied by the caller as a function returning six distances in mm (for example
+ from the encoders). The --simulate option replays an existing table with hysteresis and noise in place of
+ the platform, to exercise the pipeline without hardware.
+
+Run from the runtime directory:
+    python -m output.d_to_p_prep reduce calibration/sweep_*.csv -o output/DtoP.csv --chart calibration/summary
+    python -m output.d_to_p_prep sweep --simulate output/DtoP.csv --loads 40 80 -d calibration
+"""
+
+import os
+import sys
+import time
+import glob
+import argparse
+from multiprocessing import Pool
+import numpy as np
+
+import output.d_to_p as d_to_p
+
+import logging
+log = logging.getLogger(__name__)
+
+MAX_PRESSURE = 6000 # millibar
+NBR_DISTANCES = d_to_p.NBR_DISTANCES
+LOG_COLUMNS = ['time', 'dir'] + ['p' + str(i) for i in range(6)] + ['d' + str(i) for i in range(6)]
+UP, DOWN = 0, 1
+
+def sweep_pressures(ramp_time, period, cycles, max_pressure=MAX_PRESSURE):
+    # returns array of (direction, pressure) for each sample of the sweep
+    steps = max(int(ramp_time / period), 1)
+    up = np.linspace(0, max_pressure, steps + 1)
+    cycle = np.concatenate((np.stack((np.full(steps + 1, UP), up), axis=-1),
+                            np.stack((np.full(steps, DOWN), up[-2::-1]), axis=-1)))
+    return np.tile(cycle, (cycles, 1))
+
+def log_name(log_dir, load):
+    return os.path.join(log_dir, format("sweep_%gkg.csv" % load))
+
+def run_sweep(send_pressures, read_distances, load, log_dir, ramp_time=30, period=0.02, cycles=3, realtime=True):
+    # sweeps pressures with the given load on the platform, logging each sample. Returns the log file name
+    # send_pressures is called with a list of six int pressures, read_distances returns six distances in mm
+    # realtime False runs without waiting between samples, for simulated muscles
+    os.makedirs(log_dir, exist_ok=True)
+    fname = log_name(log_dir, load)
+    profile = sweep_pressures(ramp_time, period, cycles)
+    log.info("sweeping %g kg load, %d samples to %s", load, len(profile), fname)
+    with open(fname, 'w') as f:
+        f.write(format("# load,%g\n" % load))
+        f.write(','.join(LOG_COLUMNS) + '\n')
+        start = time.perf_counter()
+        next_sample = start
+        for direction, pressure in profile:
+            pressures = [int(pressure)] * 6
+            send_pressures(pressures)
+            next_sample += period
+            delay = next_sample - time.perf_counter()
+            if realtime and delay > 0:
+                time.sleep(delay) # give the muscles the sample period to respond before reading distances
+            distances = read_distances()
+            values = [format("%.3f" % (next_sample - start)), str(int(direction))]
+            values += [str(p) for p in pressures] + [format("%.1f" % d) for d in distances]
+            f.write(','.join(values) + '\n')
+    send_pressures([0] * 6)
+    return fname
+
+def read_log(fname):
+    # returns the load and the (samples, 14) array of the given sweep log
+    with open(fname) as f:
+        header = f.readline().lstrip('#').split(',')
+    if header[0].strip() != 'load':
+        raise ValueError(format("%s is not a sweep log" % fname))
+    return float(header[1]), np.loadtxt(fname, delimiter=',', skiprows=2, ndmin=2)
+
+def pressure_curve(pressures, distances):
+    # returns pressure for each mm of distance from samples of one actuator moving in one direction
+    # samples are averaged in 1mm bins, empty bins are interpolated and the curve is made non-decreasing
+    columns = np.rint(np.clip(distances, 0, NBR_DISTANCES - 1)).astype(int)
+    counts = np.bincount(columns, minlength=NBR_DISTANCES)
+    sums = np.bincount(columns, weights=pressures, minlength=NBR_DISTANCES)
+    filled = np.flatnonzero(counts)
+    filled = filled[filled > 0]
+    if len(filled) == 0:
+        raise ValueError("no samples with the muscle contracted")
+    means = sums / np.maximum(counts, 1)
+    if counts[-1]:
+        # at full contraction the muscle is against its stop, the lowest pressure that reached it is needed
+        means[-1] = pressures[columns == NBR_DISTANCES - 1].min()
+    curve = np.interp(np.arange(NBR_DISTANCES), filled, means[filled])
+    curve[filled[-1] + 1:] = MAX_PRESSURE # distances beyond the sweep need more than max pressure
+    curve[0] = 0 # muscle is at rest without pressure
+    return np.minimum(np.maximum.accumulate(curve), MAX_PRESSURE)
+
+def reduce_task(args):
+    # pool task: returns load, actuator and the up and down curves of one actuator in one sweep log
+    fname, actuator = args
+    load, samples = read_log(fname)
+    direction = samples[:, 1]
+    pressures = samples[:, 2 + actuator]
+    distances = samples[:, 8 + actuator]
+    curves = [pressure_curve(pressures[direction == d], distances[direction == d]) for d in (UP, DOWN)]
+    return load, actuator, curves[UP], curves[DOWN]
+
+def reduce_logs(fnames, processes=None):
+    # returns sorted loads, (loads, 6, 2, NBR_DISTANCES) actuator curves and (2, loads, NBR_DISTANCES) combined table
+    tasks = [(fname, actuator) for fname in fnames for actuator in range(6)]
+    with Pool(processes) as pool:
+        results = pool.map(reduce_task, tasks)
+    loads = sorted(set(r[0] for r in results))
+    curves = np.zeros((len(loads), 6, 2, NBR_DISTANCES))
+    for load, actuator, up, down in results:
+        curves[loads.index(load), actuator] = up, down
+    table = np.rint(np.median(curves, axis=1)).astype(int).transpose(1, 0, 2)
+    return loads, curves, table
+
+def write_table(fname, loads, table):
+    # writes the (2, loads, NBR_DISTANCES) table in the DtoP csv format and compiles the binary cache
+    with open(fname, 'w') as f:
+        f.write('# weights,' + ','.join(format("%g" % load) for load in loads) + ',' * (NBR_DISTANCES - len(loads) - 1) + '\n')
+        for row in table.reshape(-1, NBR_DISTANCES):
+            f.write(','.join(str(p) for p in row) + '\n')
+    d_to_p.compile_table(fname)
+    log.info("wrote %d load distance to pressure table to %s", len(loads), fname)
+
+def chart_summary(loads, curves, table, fname):
+    # saves a chart of the combined curves and the spread between actuators for each load
+    from output.chart import Chart
+    import matplotlib.pyplot as plt
+    chart = Chart(step_size=1, nbr_active_sensors=6)
+    fig, axes = plt.subplots(1, 2)
+    distances = np.arange(NBR_DISTANCES)
+    for idx, load in enumerate(loads):
+        color = plt.cm.viridis(idx / max(len(loads) - 1, 1))
+        for direction in (UP, DOWN):
+            axes[0].plot(distances, table[direction, idx], linestyle=chart.linesytle_by_index(direction), color=color,
+                         label=format("%g kg %s" % (load, chart.dir_str[direction])))
+            spread = curves[idx, :, direction].max(axis=0) - curves[idx, :, direction].min(axis=0)
+            axes[1].plot(distances, spread, linestyle=chart.linesytle_by_index(direction), color=color)
+    axes[0].set_title("Distance to pressure")
+    axes[0].set_xlabel("Distance in mm")
+    axes[0].set_ylabel("Pressure in millibars")
+    axes[0].legend()
+    axes[1].set_title("Spread between actuators")
+    axes[1].set_xlabel("Distance in mm")
+    axes[1].set_ylabel("Pressure in millibars")
+    chart.save_figures(fname)
+
+class SimulatedMuscles(object):
+    # stands in for the platform: muscle distances from an existing table with hysteresis, actuator spread and noise
+    def __init__(self, table_fname, load):
+        self.d_to_p = d_to_p.D_to_P(NBR_DISTANCES - 1)
+        self.d_to_p.load(table_fname)
+        weights = self.d_to_p.weights if self.d_to_p.weights else list(range(self.d_to_p.rows))
+        index = np.interp(load, weights, np.arange(len(weights)))
+        distances = np.arange(NBR_DISTANCES)[:, np.newaxis]
+        self.curves = [self.d_to_p.interpolate(np.full(6, index), distances, direction) for direction in (UP, DOWN)]
+        self.gain = np.random.uniform(0.97, 1.03, 6) # differences between muscles
+        self.pressures = np.zeros(6)
+        self.prev_pressures = np.zeros(6)
+
+    def send_pressures(self, pressures):
+        self.prev_pressures, self.pressures = self.pressures, np.asarray(pressures, dtype=float)
+
+    def read_distances(self):
+        direction = DOWN if (self.pressures < self.prev_pressures).all() else UP
+        curves = self.curves[direction]
+        distances = [np.interp(self.pressures[i] * self.gain[i], curves[:, i], np.arange(NBR_DISTANCES)) for i in range(6)]
+        return np.array(distances) + np.random.normal(0, 0.3, 6)
+
+def man():
+    parser = argparse.ArgumentParser(description='Create distance to pressure tables from calibration sweeps')
+    commands = parser.add_subparsers(dest='command', required=True)
+    sweep = commands.add_parser('sweep', help='run pressure sweeps (simulated) and reduce the logs')
+    sweep.add_argument("--simulate", required=True, metavar='TABLE', help="existing DtoP csv used to simulate the platform")
+    sweep.add_argument("--loads", type=float, nargs='+', required=True, help="loads in kg")
+    sweep.add_argument("-d", "--log_dir", default='calibration', help="directory for the sweep logs")
+    sweep.add_argument("--ramp", type=float, default=30, help="seconds for each pressure ramp")
+    sweep.add_argument("--cycles", type=int, default=3)
+    sweep.add_argument("--period", type=float, default=0.02, help="seconds between samples")
+    reduce = commands.add_parser('reduce', help='reduce sweep logs to a distance to pressure table')
+    reduce.add_argument("logs", nargs='+', help="sweep log files")
+    for p in (sweep, reduce):
+        p.add_argument("-o", "--output", default='calibration/DtoP.csv', help="distance to pressure table to write")
+        p.add_argument("--chart", default=None, help="file name (without .png) for the summary chart")
+        p.add_argument("-n", "--processes", type=int, default=None, help="worker processes (default is one per cpu)")
+    return parser
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)-8s %(message)s', datefmt='%H:%M:%S')
+    args = man().parse_args()
+    if args.command == 'sweep':
+        fnames = []
+        for load in args.loads:
+            muscles = SimulatedMuscles(args.simulate, load)
+            fnames.append(run_sweep(muscles.send_pressures, muscles.read_distances, load, args.log_dir,
+                                    args.ramp, args.period, args.cycles, realtime=False))
+    else:
+        fnames = sorted(set(f for pattern in args.logs for f in glob.glob(pattern)))
+    if not fnames:
+        sys.exit("no sweep logs found")
+    start = time.time()
+    loads, curves, table = reduce_logs(fnames, args.processes)
+    log.info("reduced %d logs in %.1f seconds", len(fnames), time.time() - start)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    write_table(args.output, loads, table)
+    if args.chart:
+        chart_summary(loads, curves, table, args.chart)
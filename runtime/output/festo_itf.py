@@ -1,7 +1,7 @@
 """
 festo_itf.py
 
-call send_pressures with list of six int muscle pressures
+call send_pressures with list (or numpy int array) of six int muscle pressures
     send_pressures([100,200,300,400,500,600])
 optionally set a second parm True to read and return actual pressures following the send
     actuals = send_pressures([100,200,300,400,500,600], True)
@@ -71,6 +71,8 @@ class Festo(object):
         # sends muscle pressures to Festo
         try:
             # print "sending pressures:", muscle_pressures
+            if hasattr(muscle_pressures, 'tolist'):
+                muscle_pressures = muscle_pressures.tolist() # easyip encodes lists of python ints
             packet = easyip.Factory.send_flagword(0, muscle_pressures)
             self._output_festo_packet(packet, self.wait)
             self.out_pressures = muscle_pressures
@@ -127,7 +129,7 @@ class Festo(object):
             resp = self._output_festo_packet(packet, True)
             # print resp
             values = resp.decode_payload(easyip.Packet.DIRECTION_REQ)
-            print("in _get_festo_pressure", list(values))
+            # print("in _get_festo_pressure", list(values))
             return list(values)
         except socket.timeout:
             log.warning("timeout waiting for Pressures from Festo")
@@ -25,6 +25,7 @@ PLOT_PRESSURES = False
 class MuscleOutput(object):
     def __init__(self, d_to_p_func, FST_ip = '192.168.0.10', max_actuator_range = 200):
         self.distance_to_pressure = d_to_p_func
+        self.d_to_p = getattr(d_to_p_func, '__self__', None) # D_to_P instance when given its distance_to_pressure method
         self.festo = festo_itf.Festo(FST_ip)
         self.max_actuator_range = max_actuator_range # max contraction in mm
         self.in_pressures = [0]*6
@@ -33,7 +34,12 @@ class MuscleOutput(object):
         self.is_enabled = False
         self.loaded_weight = 100 # default payload in kg
         self.prev_time = time.perf_counter()
-        self.sent_pressures = [0]*6
+        self.sent_pressures = [0]*6 # pressures in the most recent frame sent to festo
+        self.deadband = 0 # frames are not sent if no pressure has changed by more than this many millibars
+        self.keepalive_interval = 0.5 # max seconds between frames sent to festo
+        self.send_time = 0
+        self.nbr_frames_sent = 0
+        self.nbr_frames_suppressed = 0
         if PLOT_PRESSURES:
             from common.plot_itf import PlotItf
             nbr_plots = 6
@@ -46,11 +52,32 @@ class MuscleOutput(object):
     def set_progress_callback(self, cb):
         self.progress_callback = cb
 
-    def send_pressures(self, pressures):
+    def set_send_policy(self, deadband_mbar, keepalive_interval):
+        # frames within the deadband of the last frame sent are skipped unless keepalive_interval seconds have passed
+        self.deadband = deadband_mbar
+        self.keepalive_interval = keepalive_interval
+        log.info("festo output deadband %d mb, keepalive %.2f seconds", deadband_mbar, keepalive_interval)
+
+    def send_pressures(self, pressures, force=False):
+        # sends pressures to festo if any has changed by more than the deadband, force True always sends
+        now = time.perf_counter()
+        if not force and now - self.send_time < self.keepalive_interval:
+            for p, sent in zip(pressures, self.sent_pressures):
+                if abs(p - sent) > self.deadband:
+                    break
+            else:
+                self.nbr_frames_suppressed += 1
+                return
         self.festo.send_pressures(pressures)
         self.sent_pressures = pressures
+        self.send_time = now
+        self.nbr_frames_sent += 1
         # print("in output send pressures", pressures)
 
+    def output_counters(self):
+        # returns number of frames sent and suppressed
+        return self.nbr_frames_sent, self.nbr_frames_suppressed
+
     def get_pressures(self):
         # returns actual pressures if available from festo, else returns sent pressure
         self.in_pressures = self.festo.get_pressure()
@@ -80,9 +107,10 @@ class MuscleOutput(object):
             self.activate_piston_flag = 0
 
     def set_payload(self, payload_kg):
-        #  set total weight in kilograms
-        #  Todo - was used on platforms without encoders, not yet supported in V3
+        #  set total weight in kilograms, selects the distance to pressure curves for this weight
         self.loaded_weight = payload_kg
+        if self.d_to_p is not None:
+            self.d_to_p.set_payload(payload_kg)
 
     def set_enable(self, state, current_actuator_lengths, target_actuator_lengths):
         """
@@ -172,8 +200,9 @@ class MuscleOutput(object):
     
     def move_distance(self, distances):
         """ parm is list of muscle movements in mm from rest positions """ 
-        for idx, d in enumerate(distances):
-            distances[idx] = int(round(d))
+        # distances are deliberately not rounded to whole millimetres (as they were before d_to_p interpolated
+        #  between distance columns), rounding would put up to 0.5mm of steps into the pressures.
+        # The caller's distances are not modified
         try:
             out_pressures = self.distance_to_pressure(distances)
             # print("distances,", (','.join(str(d) for d in distances)), "pressures,", (','.join(str(p) for p in out_pressures)))
@@ -196,6 +225,13 @@ class MuscleOutput(object):
         # moves platform to mid pressure to determine best d_to_p files
         self.slow_pressure_move(0,3000, 1000)
 
+    def calibration_sweep(self, read_distances, load, log_dir='calibration'):
+        # logs a pressure sweep with the given load (kg) for building distance to pressure tables, see d_to_p_prep.py
+        #  read_distances returns the six measured muscle distances in mm.  caution, this moves even if disabled
+        import output.d_to_p_prep as d_to_p_prep
+        # every step is sent so the logged pressures are those at the valves
+        return d_to_p_prep.run_sweep(lambda pressures: self.send_pressures(pressures, True), read_distances, load, log_dir)
+
     def slow_move(self, start, end, rate_cm_per_s):
         raise Exception("slow_move method now implimented in platform_controller")
         # moves from the given start to end lengths at the given duration
@@ -223,7 +259,7 @@ class MuscleOutput(object):
     def slow_pressure_move(self, start_pressure, end_pressure, duration_ms):
         #  caution, this moves even if disabled
         interval = 50  # time between steps in ms
-        steps = duration_ms / interval
+        steps = int(duration_ms / interval)
         if steps < 1:
             self.send_pressures([end_pressure]*6)
         else:            
@@ -234,6 +270,7 @@ class MuscleOutput(object):
             for step in range(steps):
                 current  =  [p+delta for p in current]
                 #  print(current)
+                self.send_pressures([int(round(p)) for p in current])
                 gutil.sleep_qt(interval / 1000.0)
                 if self.progress_callback:
                     self.progress_callback(100 * step/steps)
@@ -0,0 +1,125 @@
+""" payload_estimator
+Estimates the rider payload from the muscle pressures and measured distances and selects the distance to pressure curves
+
+While active (the platform is enabled and holding the load position) a background thread samples the
+ pressures read back from the Festo and the muscle distances measured by the caller's read_distances function
+ (eg from encoders). A heavier rider leaves the muscles less contracted at the same pressure, so when a window
+ of samples is steady the mean pressure of each muscle at its mean measured distance is matched against the
+ loaded curves (D_to_P.curve_index) to find the curve index for that muscle, so riders sitting off centre get
+ different curves for each muscle.
+The distances must be measured: the commanded distances (D_to_P.prev_distances) were converted to pressure
+ with the curves in use, and the regulators hold the readback at the commanded pressure, so matching them
+ would only return the curves already selected.
+The new indices are swapped in with D_to_P.set_curve_index, outside the control tick, only when they differ
+ from those in use by more than the hysteresis. The payload is the mean of the muscle estimates, converted
+ with the weights in the table header.
+
+    estimator = PayloadEstimator(d_to_p, festo, read_distances)  # read_distances returns six measured distances in mm
+    estimator.start()
+    estimator.set_active(True)  # call with False when the ride starts
+
+SimInterface does not create an estimator as the platforms have no muscle distance measurement yet,
+ the payload is set from the remote controls (MuscleOutput.set_payload)
+"""
+
+import time
+import threading
+from collections import deque
+import numpy as np
+
+import logging
+log = logging.getLogger(__name__)
+
+class PayloadEstimator(object):
+    def __init__(self, d_to_p, festo, read_distances, sample_period=0.1, window=20, max_pressure_deviation=50,
+                 max_distance_deviation=2, hysteresis=0.05):
+        self.d_to_p = d_to_p
+        self.festo = festo
+        self.read_distances = read_distances # returns the six measured muscle contractions in mm
+        self.sample_period = sample_period # seconds between samples
+        self.window = window # samples needed for an estimate
+        self.max_pressure_deviation = max_pressure_deviation # std dev of steady pressures
+        self.max_distance_deviation = max_distance_deviation # std dev of steady distances in mm
+        self.hysteresis = hysteresis # min change in curve index to swap curves
+        self.samples = deque(maxlen=window)
+        self.is_active = False
+        self.is_running = False
+        self.payload = None # most recent estimate in kg, None if not yet estimated
+        self.callback = None # called with the new payload when the curves are changed
+
+    def set_callback(self, cb):
+        self.callback = cb
+
+    def set_active(self, state):
+        # estimates are only made while active, set when the platform holds the rider at the load position
+        if state != self.is_active:
+            self.samples.clear()
+            self.is_active = state
+            log.debug("payload estimation %s", "active" if state else "inactive")
+
+    def start(self):
+        self.festo.enable_poll_pressure(True)
+        self.is_running = True
+        t = threading.Thread(target=self.estimate_thread)
+        t.daemon = True
+        t.start()
+
+    def stop(self):
+        self.is_running = False
+
+    def estimate_thread(self):
+        while self.is_running:
+            time.sleep(self.sample_period)
+            if self.is_active:
+                self.add_sample(self.festo.get_pressure(), self.read_distances())
+
+    def add_sample(self, pressures, distances):
+        self.samples.append((list(pressures), list(distances)))
+        if len(self.samples) == self.window:
+            samples = np.array(self.samples, dtype=float)
+            pressures, distances = samples[:, 0], samples[:, 1]
+            if (pressures > 0).all() and (pressures.std(axis=0) < self.max_pressure_deviation).all() \
+                    and (distances.std(axis=0) < self.max_distance_deviation).all():
+                self.estimate(pressures.mean(axis=0), distances.mean(axis=0))
+                self.samples.clear()
+
+    def estimate(self, pressures, distances):
+        # selects the curves matching the given steady pressures at the given measured distances
+        curve_sets = np.array(self.d_to_p.curve_set)
+        index = self.d_to_p.curve_index(pressures, distances, curve_sets)
+        current = self.d_to_p.curve_idx[curve_sets, np.arange(6)]
+        try:
+            self.payload = float(self.d_to_p.index_to_payload(index).mean())
+        except ValueError:
+            self.payload = None # table has no weights, curves are still selected
+        if np.abs(index - current).max() > self.hysteresis:
+            self.d_to_p.set_curve_index(index)
+            log.info("curves selected for estimated payload %s kg, index %s",
+                     "unknown" if self.payload is None else format("%.0f" % self.payload), np.round(index, 2).tolist())
+            if self.callback:
+                self.callback(self.payload)
+        return index
+
+if __name__ == "__main__":
+    # shows estimation from simulated steady pressures and measured distances, starting from the wrong curves
+    # run from the runtime directory as: python -m output.payload_estimator
+    import os
+    from output.d_to_p import D_to_P
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    d_to_p = D_to_P(200)
+    d_to_p.load(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'DtoP.csv'))
+    estimator = PayloadEstimator(d_to_p, None, None)
+    estimator.set_active(True)
+    d_to_p.set_payload(60)
+    curve_sets = np.array(d_to_p.curve_set)
+    columns = np.arange(d_to_p.nbr_columns, dtype=float)
+    commanded = d_to_p.distance_to_pressure([100, 102, 98, 100, 101, 99]) # pressures holding the load position
+    for payload in (50, 70, 72, 45):
+        # distances the muscles reach at these pressures with the rider slightly forward
+        index = d_to_p.payload_to_index(payload + np.array([3, 3, 0, -3, -3, 0]))
+        curves = d_to_p.interpolate(index, columns[:, np.newaxis], curve_sets) # (distances, 6) pressures of the rider
+        measured = np.array([np.interp(commanded[i], curves[:, i], columns) for i in range(6)])
+        for sample in range(estimator.window):
+            estimator.add_sample(commanded + np.random.normal(0, 10, 6), measured + np.random.normal(0, 0.5, 6))
+        print(format("rider %d kg, estimated %.1f kg" % (payload, estimator.payload)))
@@ -0,0 +1,148 @@
+""" valve_bias
+Online correction of the valve bias in distance to pressure output, from the pressures read back from the Festo
+
+The proportional valves and regulators deliver a pressure that differs from the commanded pressure by a bias
+ that varies between muscles, with pressure, and drifts as the valves warm up. A background thread samples the
+ commanded pressures, the actual pressures read back from the Festo (offset 10, see festo_itf) and the
+ commanded muscle distances. The samples are averaged over sliding windows and each window updates a running
+ (recursive) least squares fit, for each muscle and curve set, of the pressure error (actual - commanded) as a
+ linear function of distance.
+The negated fit is passed to D_to_P.set_correction and added to the table output, so the delivered
+ pressure matches the commanded table value.
+Updates are bounded: each window can move a correction by at most max_step and the total correction
+ is clamped to +- max_offset, so a bad readback can not drive the platform far from the calibration.
+
+Only the valve side is corrected. Drift in muscle length or stiffness changes the distance reached at a given
+ pressure, which needs measured muscle distances (eg encoders) and is not detected from pressure readback.
+
+    corrector = ValveBiasCorrection(d_to_p, festo)
+    corrector.start()     # enables festo pressure polling
+    corrector.stop()
+"""
+
+import time
+import threading
+from collections import deque
+import numpy as np
+
+import logging
+log = logging.getLogger(__name__)
+
+class ValveBiasCorrection(object):
+    def __init__(self, d_to_p, festo, sample_period=0.1, window=20, forgetting=0.95, max_step=20, max_offset=300):
+        self.d_to_p = d_to_p
+        self.festo = festo
+        self.sample_period = sample_period # seconds between samples
+        self.window = window # samples averaged for each least squares update
+        self.forgetting = forgetting # weight of previous windows in the fit, 1 never forgets
+        self.max_step = max_step # max change in a correction (pressure units) per update
+        self.max_offset = max_offset # max correction in pressure units at any distance
+        self.samples = deque(maxlen=window)
+        self.lock = threading.Lock()
+        self.is_running = False
+        self.nbr_updates = 0
+        self.nbr_rejected = 0 # muscle windows discarded because the readback was missing or the curve set changed
+        self.reset()
+
+    def reset(self):
+        # clears the fit and the corrections, call after a new D_to_P table is loaded
+        with self.lock:
+            self.samples.clear()
+            self.theta = np.zeros((2, 6, 2)) # fitted error = theta[0] + theta[1] * distance / scale
+            self.covariance = np.tile(np.eye(2) * 1000.0, (2, 6, 1, 1))
+        self.d_to_p.set_correction(None)
+
+    def start(self):
+        self.festo.enable_poll_pressure(True)
+        self.is_running = True
+        t = threading.Thread(target=self.adapt_thread)
+        t.daemon = True
+        t.start()
+
+    def stop(self):
+        self.is_running = False
+
+    def corrections(self):
+        # returns (2, 6, 2) array of the offset and slope (per mm) added to the pressures of each curve set and muscle
+        with self.lock:
+            theta = self.theta.copy()
+        theta[..., 1] /= self.distance_scale()
+        return -theta
+
+    def distance_scale(self):
+        return self.d_to_p.nbr_columns - 1
+
+    def adapt_thread(self):
+        while self.is_running:
+            time.sleep(self.sample_period)
+            self.add_sample(self.festo.out_pressures, self.festo.get_pressure(),
+                            self.d_to_p.prev_distances, self.d_to_p.curve_set)
+
+    def add_sample(self, commanded, actual, distances, curve_set):
+        # adds one sample, updates the fit each time a full window has been collected
+        self.samples.append((list(commanded), list(actual), list(distances), list(curve_set)))
+        if len(self.samples) == self.window:
+            self.update(np.array(self.samples, dtype=float))
+            self.samples.clear()
+
+    def update(self, samples):
+        # samples is (window, 4, 6) array of commanded, actual, distance and curve set
+        commanded, actual, distances, curve_sets = samples.transpose(1, 0, 2)
+        # a muscle's window is used if every readback is valid and it stayed on one curve set
+        valid = (actual > 0).all(axis=0) & (curve_sets == curve_sets[0]).all(axis=0)
+        self.nbr_rejected += int((~valid).sum())
+        if not valid.any():
+            return
+        muscles = np.flatnonzero(valid)
+        sets = curve_sets[0, muscles].astype(int)
+        error = (actual - commanded).mean(axis=0)[muscles]
+        x = np.stack((np.ones(len(muscles)), distances.mean(axis=0)[muscles] / self.distance_scale()), axis=-1)
+        with self.lock:
+            theta = self.theta[sets, muscles]
+            P = self.covariance[sets, muscles]
+            # recursive least squares with exponential forgetting, each selected muscle updated independently
+            Px = np.einsum('mij,mj->mi', P, x)
+            gain = Px / (self.forgetting + np.einsum('mi,mi->m', x, Px))[:, np.newaxis]
+            step = gain * (error - np.einsum('mi,mi->m', x, theta))[:, np.newaxis]
+            # bound the change in the fitted error at both ends of the distance range
+            change = np.stack((step[:, 0], step[:, 0] + step[:, 1]), axis=-1)
+            scale = np.minimum(1.0, self.max_step / np.maximum(np.abs(change).max(axis=-1), 1e-9))
+            theta = theta + step * scale[:, np.newaxis]
+            # clamp the total correction at zero and full distance, keeping the fit linear
+            ends = np.clip(np.stack((theta[:, 0], theta[:, 0] + theta[:, 1]), axis=-1), -self.max_offset, self.max_offset)
+            theta = np.stack((ends[:, 0], ends[:, 1] - ends[:, 0]), axis=-1)
+            self.theta[sets, muscles] = theta
+            self.covariance[sets, muscles] = (P - np.einsum('mi,mj->mij', gain, Px)) / self.forgetting
+        self.nbr_updates += 1
+        self.d_to_p.set_correction(self.corrections())
+        log.debug("pressure corrections updated for muscles %s", muscles.tolist())
+
+if __name__ == "__main__":
+    # simulates a drifting valve bias and shows the corrections converging
+    # run from the runtime directory as: python -m output.valve_bias
+    import os
+    from output.d_to_p import D_to_P
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+
+    class DriftingFesto(object):
+        # valves deliver commanded pressure with a bias that depends on the muscle and distance
+        out_pressures = [0]*6
+        def enable_poll_pressure(self, state):
+            pass
+
+    d_to_p = D_to_P(200)
+    d_to_p.load(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'DtoP.csv'))
+    festo = DriftingFesto()
+    adapter = ValveBiasCorrection(d_to_p, festo)
+    bias = np.array([-150, -80, 0, 40, 120, 200])
+    t = np.arange(4000) * 0.05
+    for frame in range(len(t)):
+        distances = 100 + 80 * np.sin(t[frame] * (0.5 + np.arange(6) * 0.1))
+        commanded = np.array(d_to_p.distance_to_pressure(distances.tolist()))
+        actual = commanded + bias * (0.5 + distances / 200) + np.random.normal(0, 20, 6)
+        adapter.add_sample(commanded, np.maximum(actual, 1), d_to_p.prev_distances, d_to_p.curve_set)
+        if frame % 800 == 799:
+            sets = np.array(d_to_p.curve_set)
+            target = d_to_p.interpolate(d_to_p.curve_idx[sets, np.arange(6)], distances, sets) # uncorrected table
+            residual = target - (commanded + bias * (0.5 + distances / 200)) # remaining error of delivered pressure
+            print(format("after %3d updates, pressure error %s" % (adapter.nbr_updates, np.round(residual).astype(int))))